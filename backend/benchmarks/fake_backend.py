@@ -0,0 +1,479 @@
+"""
+ベンチマーク用のOpenAI (Assistants / Files / Vector Stores) とAIKOの簡易スタブサーバー。
+実際のAPIを呼ばずにバックエンドの負荷試験を行うために使用する。
+
+    uvicorn benchmarks.fake_backend:app --port 8100
+
+レイテンシと失敗率は環境変数で設定する (FAKE_* を参照)。
+"""
+import asyncio
+import os
+import random
+import time
+import uuid
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+
+# 全リクエスト共通のレイテンシと失敗率
+LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "50"))
+LATENCY_JITTER_MS = float(os.getenv("FAKE_LATENCY_JITTER_MS", "20"))
+FAILURE_RATE = float(os.getenv("FAKE_FAILURE_RATE", "0"))
+# Runの処理時間と、ツール呼び出し (call_dxa_factory) を要求する割合
+RUN_SECONDS = float(os.getenv("FAKE_RUN_SECONDS", "1.5"))
+TOOL_CALL_RATE = float(os.getenv("FAKE_TOOL_CALL_RATE", "0.5"))
+# Vector Storeのインデックス作成時間
+INDEXING_SECONDS = float(os.getenv("FAKE_INDEXING_SECONDS", "1.0"))
+# AIKO /messages/sync のレイテンシと失敗率
+AIKO_LATENCY_MS = float(os.getenv("FAKE_AIKO_LATENCY_MS", "800"))
+AIKO_LATENCY_JITTER_MS = float(os.getenv("FAKE_AIKO_LATENCY_JITTER_MS", "400"))
+AIKO_FAILURE_RATE = float(os.getenv("FAKE_AIKO_FAILURE_RATE", "0"))
+
+app = FastAPI()
+
+assistants = {}
+threads = {}
+messages = {}   # thread_id -> list
+runs = {}       # run_id -> dict
+files = {}      # file_id -> dict
+file_contents = {}
+vector_stores = {}
+vector_store_files = {}  # vector_store_id -> {file_id: dict}
+
+
+def _id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def _page(items):
+    return {
+        "object": "list",
+        "data": items,
+        "first_id": items[0]["id"] if items else None,
+        "last_id": items[-1]["id"] if items else None,
+        "has_more": False,
+    }
+
+
+def _cursor_page(items, limit=20, after=None):
+    """after以降のlimit件を返す (SDKは空のページが返るまで次のページを取得する)"""
+    ids = [item["id"] for item in items]
+    if after in ids:
+        items = items[ids.index(after) + 1:]
+    elif after:
+        items = []
+    page = _page(items[:limit])
+    page["has_more"] = len(items) > limit
+    return page
+
+
+def _error(status, message):
+    return JSONResponse(status_code=status, content={"error": {"message": message, "type": "fake_error"}})
+
+
+@app.middleware("http")
+async def inject_latency_and_failures(request: Request, call_next):
+    if request.url.path.startswith("/aiko/"):
+        latency, jitter, failure_rate = AIKO_LATENCY_MS, AIKO_LATENCY_JITTER_MS, AIKO_FAILURE_RATE
+    else:
+        latency, jitter, failure_rate = LATENCY_MS, LATENCY_JITTER_MS, FAILURE_RATE
+    await asyncio.sleep(max(0.0, latency + random.uniform(-jitter, jitter)) / 1000)
+    if random.random() < failure_rate:
+        return _error(500, "injected failure")
+    return await call_next(request)
+
+
+# --- Assistants ---
+
+@app.post("/v1/assistants")
+async def create_assistant(request: Request):
+    body = await request.json()
+    assistant = {
+        "id": _id("asst"),
+        "object": "assistant",
+        "created_at": int(time.time()),
+        "name": body.get("name"),
+        "model": body.get("model"),
+        "instructions": body.get("instructions"),
+        "tools": body.get("tools", []),
+        "tool_resources": body.get("tool_resources"),
+        "metadata": {},
+    }
+    assistants[assistant["id"]] = assistant
+    return assistant
+
+
+@app.get("/v1/assistants/{assistant_id}")
+async def retrieve_assistant(assistant_id: str):
+    if assistant_id not in assistants:
+        return _error(404, "No assistant found")
+    return assistants[assistant_id]
+
+
+@app.post("/v1/assistants/{assistant_id}")
+async def update_assistant(assistant_id: str, request: Request):
+    if assistant_id not in assistants:
+        return _error(404, "No assistant found")
+    assistants[assistant_id].update(await request.json())
+    return assistants[assistant_id]
+
+
+# --- Threads / Messages ---
+
+@app.post("/v1/threads")
+async def create_thread():
+    thread = {"id": _id("thread"), "object": "thread", "created_at": int(time.time()), "metadata": {}}
+    threads[thread["id"]] = thread
+    messages[thread["id"]] = []
+    return thread
+
+
+def _message(thread_id, role, text, run_id=None):
+    return {
+        "id": _id("msg"),
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "role": role,
+        "run_id": run_id,
+        "status": "completed",
+        "attachments": [],
+        "metadata": {},
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+    }
+
+
+@app.post("/v1/threads/{thread_id}/messages")
+async def create_message(thread_id: str, request: Request):
+    if thread_id not in threads:
+        return _error(404, "No thread found")
+    body = await request.json()
+    content = body.get("content")
+    if isinstance(content, list):
+        text = " ".join(item.get("text", "") for item in content if item.get("type") == "text")
+    else:
+        text = content or ""
+    message = _message(thread_id, body.get("role", "user"), text)
+    messages[thread_id].append(message)
+    return message
+
+
+@app.get("/v1/threads/{thread_id}/messages")
+async def list_messages(thread_id: str, limit: int = 20, order: str = "desc",
+                        after: str | None = None, before: str | None = None):
+    if thread_id not in threads:
+        return _error(404, "No thread found")
+    items = list(messages[thread_id])
+    if order == "desc":
+        items.reverse()
+    ids = [item["id"] for item in items]
+    if after in ids:
+        items = items[ids.index(after) + 1:]
+    elif before in ids:
+        items = items[:ids.index(before)]
+    page = _page(items[:limit])
+    page["has_more"] = len(items) > limit
+    return page
+
+
+# --- Runs ---
+
+def _run_view(run):
+    """経過時間に応じてRunの状態を進める"""
+    elapsed = time.monotonic() - run["_phase_started"]
+    if run["status"] in ("queued", "in_progress") and elapsed >= RUN_SECONDS / 2:
+        if run["_needs_tool"] and not run["_tool_submitted"]:
+            run["status"] = "requires_action"
+            run["required_action"] = {
+                "type": "submit_tool_outputs",
+                "submit_tool_outputs": {"tool_calls": [{
+                    "id": _id("call"),
+                    "type": "function",
+                    "function": {
+                        "name": "call_dxa_factory",
+                        "arguments": '{"question": "今期の営業利益はいくらですか？"}',
+                    },
+                }]},
+            }
+        elif elapsed >= (RUN_SECONDS / 2 if run["_tool_submitted"] else RUN_SECONDS):
+            _complete_run(run)
+    elif run["status"] == "queued":
+        run["status"] = "in_progress"
+    return {key: value for key, value in run.items() if not key.startswith("_")}
+
+
+def _complete_run(run):
+    run["status"] = "completed"
+    run["completed_at"] = int(time.time())
+    run["required_action"] = None
+    run["usage"] = {"prompt_tokens": 500, "completion_tokens": 120, "total_tokens": 620}
+    messages[run["thread_id"]].append(
+        _message(run["thread_id"], "assistant", "ベンチマーク用の回答です。", run["id"])
+    )
+
+
+@app.post("/v1/threads/runs")
+async def create_thread_and_run(request: Request):
+    body = await request.json()
+    thread = await create_thread()
+    for message in body.get("thread", {}).get("messages", []):
+        messages[thread["id"]].append(_message(thread["id"], message.get("role", "user"), message.get("content", "")))
+    return _new_run(thread["id"], body)
+
+
+@app.post("/v1/threads/{thread_id}/runs")
+async def create_run(thread_id: str, request: Request):
+    if thread_id not in threads:
+        return _error(404, "No thread found")
+    return _new_run(thread_id, await request.json())
+
+
+def _new_run(thread_id, body):
+    run = {
+        "id": _id("run"),
+        "object": "thread.run",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "assistant_id": body.get("assistant_id"),
+        "model": body.get("model"),
+        "status": "queued",
+        "required_action": None,
+        "usage": None,
+        "tools": [],
+        "_phase_started": time.monotonic(),
+        "_needs_tool": random.random() < TOOL_CALL_RATE,
+        "_tool_submitted": False,
+    }
+    runs[run["id"]] = run
+    return _run_view(run)
+
+
+@app.get("/v1/threads/{thread_id}/runs/{run_id}")
+async def retrieve_run(thread_id: str, run_id: str):
+    if run_id not in runs:
+        return _error(404, "No run found")
+    return _run_view(runs[run_id])
+
+
+@app.post("/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs")
+async def submit_tool_outputs(thread_id: str, run_id: str):
+    run = runs.get(run_id)
+    if not run or run["status"] != "requires_action":
+        return _error(400, "Run is not waiting for tool outputs")
+    run["status"] = "in_progress"
+    run["required_action"] = None
+    run["_tool_submitted"] = True
+    run["_tool_submitted_at"] = int(time.time())
+    run["_phase_started"] = time.monotonic()
+    return _run_view(run)
+
+
+@app.post("/v1/threads/{thread_id}/runs/{run_id}/cancel")
+async def cancel_run(thread_id: str, run_id: str):
+    run = runs.get(run_id)
+    if not run:
+        return _error(404, "No run found")
+    run["status"] = "cancelled"
+    return _run_view(run)
+
+
+@app.get("/v1/threads/{thread_id}/runs/{run_id}/steps")
+async def list_run_steps(thread_id: str, run_id: str, limit: int = 20, after: str | None = None):
+    run = runs.get(run_id)
+    if not run:
+        return _error(404, "No run found")
+    steps = []
+    message_started = run["created_at"]
+    if run.get("_tool_submitted_at"):
+        steps.append({
+            "id": _id("step"),
+            "object": "thread.run.step",
+            "run_id": run_id,
+            "thread_id": thread_id,
+            "type": "tool_calls",
+            "status": "completed",
+            "created_at": run["created_at"],
+            "completed_at": run["_tool_submitted_at"],
+            "step_details": {"type": "tool_calls", "tool_calls": [{
+                "id": _id("call"),
+                "type": "function",
+                "function": {"name": "call_dxa_factory", "arguments": "{}", "output": ""},
+            }]},
+        })
+        message_started = run["_tool_submitted_at"]
+    steps.append({
+        "id": _id("step"),
+        "object": "thread.run.step",
+        "run_id": run_id,
+        "thread_id": thread_id,
+        "type": "message_creation",
+        "status": "completed",
+        "created_at": message_started,
+        "completed_at": run.get("completed_at"),
+        "step_details": {"type": "message_creation", "message_creation": {"message_id": ""}},
+    })
+    # 呼び出し毎にIDを振り直さないよう、Runに保持して返す
+    if run["status"] in ("completed", "failed", "cancelled", "expired"):
+        steps = run.setdefault("_steps", steps)
+    return _cursor_page(steps, limit, after)
+
+
+# --- Files ---
+
+@app.post("/v1/files")
+async def create_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    content = await file.read()
+    item = {
+        "id": _id("file"),
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": file.filename,
+        "purpose": purpose,
+        "status": "processed",
+    }
+    files[item["id"]] = item
+    file_contents[item["id"]] = content
+    return item
+
+
+@app.get("/v1/files")
+async def list_files():
+    return _page(list(files.values()))
+
+
+@app.get("/v1/files/{file_id}")
+async def retrieve_file(file_id: str):
+    if file_id not in files:
+        return _error(404, "No file found")
+    return files[file_id]
+
+
+@app.get("/v1/files/{file_id}/content")
+async def retrieve_file_content(file_id: str):
+    if file_id not in files:
+        return _error(404, "No file found")
+    return Response(content=file_contents[file_id], media_type="application/octet-stream")
+
+
+@app.delete("/v1/files/{file_id}")
+async def delete_file(file_id: str):
+    deleted = files.pop(file_id, None) is not None
+    file_contents.pop(file_id, None)
+    return {"id": file_id, "object": "file", "deleted": deleted}
+
+
+# --- Vector Stores ---
+
+@app.post("/v1/vector_stores")
+async def create_vector_store(request: Request):
+    body = await request.json() if await request.body() else {}
+    store = {
+        "id": _id("vs"),
+        "object": "vector_store",
+        "created_at": int(time.time()),
+        "name": body.get("name"),
+        "status": "completed",
+        "usage_bytes": 0,
+        "file_counts": {"in_progress": 0, "completed": 0, "failed": 0, "cancelled": 0, "total": 0},
+        "metadata": {},
+    }
+    vector_stores[store["id"]] = store
+    vector_store_files[store["id"]] = {}
+    return store
+
+
+@app.get("/v1/vector_stores")
+async def list_vector_stores(limit: int = 20, after: str | None = None):
+    items = sorted(vector_stores.values(), key=lambda store: store["created_at"], reverse=True)
+    return _cursor_page(items, limit, after)
+
+
+@app.get("/v1/vector_stores/{vector_store_id}")
+async def retrieve_vector_store(vector_store_id: str):
+    if vector_store_id not in vector_stores:
+        return _error(404, "No vector store found")
+    return vector_stores[vector_store_id]
+
+
+def _vector_store_file_view(item):
+    if item["status"] == "in_progress" and time.monotonic() - item["_started"] >= INDEXING_SECONDS:
+        item["status"] = "completed"
+    return {key: value for key, value in item.items() if not key.startswith("_")}
+
+
+@app.post("/v1/vector_stores/{vector_store_id}/files")
+async def create_vector_store_file(vector_store_id: str, request: Request):
+    if vector_store_id not in vector_stores:
+        return _error(404, "No vector store found")
+    body = await request.json()
+    item = {
+        "id": body["file_id"],
+        "object": "vector_store.file",
+        "created_at": int(time.time()),
+        "vector_store_id": vector_store_id,
+        "status": "in_progress",
+        "last_error": None,
+        "usage_bytes": len(file_contents.get(body["file_id"], b"")),
+        "_started": time.monotonic(),
+    }
+    vector_store_files[vector_store_id][item["id"]] = item
+    return _vector_store_file_view(item)
+
+
+@app.get("/v1/vector_stores/{vector_store_id}/files")
+async def list_vector_store_files(vector_store_id: str):
+    return _page([_vector_store_file_view(item) for item in vector_store_files.get(vector_store_id, {}).values()])
+
+
+@app.get("/v1/vector_stores/{vector_store_id}/files/{file_id}")
+async def retrieve_vector_store_file(vector_store_id: str, file_id: str):
+    item = vector_store_files.get(vector_store_id, {}).get(file_id)
+    if not item:
+        return _error(404, "No vector store file found")
+    return _vector_store_file_view(item)
+
+
+@app.delete("/v1/vector_stores/{vector_store_id}/files/{file_id}")
+async def delete_vector_store_file(vector_store_id: str, file_id: str):
+    deleted = vector_store_files.get(vector_store_id, {}).pop(file_id, None) is not None
+    return {"id": file_id, "object": "vector_store.file.deleted", "deleted": deleted}
+
+
+# --- AIKO ---
+
+@app.post("/aiko/conversations")
+async def create_conversation():
+    return {"id": _id("conv")}
+
+
+@app.post("/aiko/conversations/{conversation_id}/messages/sync")
+async def send_aiko_message(conversation_id: str, request: Request):
+    body = await request.json()
+    task_result = {
+        "content": f"ベンチマーク用のDXA回答: {body.get('message')}",
+        "citations": [{
+            "source": "決算短信.pdf",
+            "file_path": "/docs/決算短信.pdf",
+            "page_index": 1,
+            "type": "pdf",
+            "image_src": None,
+        }],
+    }
+    return {
+        "status": "success",
+        "answer": {
+            "success": True,
+            "task_id": _id("task"),
+            "response": {
+                "main_task": body.get("message"),
+                "ooda_task_id": _id("ooda"),
+                "task_result": task_result,
+                "substasks": [{
+                    "status": "completed",
+                    "task": body.get("message"),
+                    "task_id": _id("task"),
+                    "task_result": task_result,
+                }],
+            },
+        },
+    }
@@ -0,0 +1,242 @@
+"""
+バックエンドの負荷試験。スタブサーバー (fake_backend) とバックエンドを起動し、
+/api/chat・/api/files・/api/upload に並列でリクエストを送り、
+エンドポイント毎のスループットとp50/p95/p99レイテンシをJSONで出力する。
+
+    cd backend
+    python -m benchmarks.load_test --concurrency 16 --requests 200 --output bench.json
+
+既に起動済みのバックエンドを対象にする場合は --backend-url を指定する。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def error(self, name, message):
+        self.errors.setdefault(name, []).append(message)
+
+    def summary(self, wall_seconds):
+        result = {}
+        for name in sorted(set(self.samples) | set(self.errors)):
+            values = self.samples.get(name, [])
+            errors = self.errors.get(name, [])
+            result[name] = {
+                "count": len(values),
+                "errors": len(errors),
+                "error_samples": errors[:5],
+                "throughput_rps": len(values) / wall_seconds if wall_seconds else None,
+                "mean_ms": sum(values) / len(values) * 1000 if values else None,
+                "p50_ms": _ms(percentile(values, 0.50)),
+                "p95_ms": _ms(percentile(values, 0.95)),
+                "p99_ms": _ms(percentile(values, 0.99)),
+                "max_ms": _ms(max(values) if values else None),
+            }
+        return result
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+async def chat_once(client, recorder):
+    started = time.perf_counter()
+    first_event = None
+    completed = False
+    try:
+        async with client.stream("POST", "/api/chat", json={"text": "今期の営業利益はいくらですか？"}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                if json.loads(line).get("type") == "complete":
+                    completed = True
+        if not completed:
+            raise RuntimeError("stream ended without complete event")
+    except Exception as e:
+        recorder.error("POST /api/chat", repr(e))
+        return
+    recorder.record("POST /api/chat", time.perf_counter() - started)
+    recorder.record("POST /api/chat (first event)", first_event)
+
+
+async def files_once(client, recorder):
+    started = time.perf_counter()
+    try:
+        response = await client.get("/api/files")
+        response.raise_for_status()
+    except Exception as e:
+        recorder.error("GET /api/files", repr(e))
+        return
+    recorder.record("GET /api/files", time.perf_counter() - started)
+
+
+async def upload_once(client, recorder, wait_for_job):
+    # 重複排除の対象にならないよう毎回異なる内容を送る
+    content = f"benchmark {uuid.uuid4().hex}\n".encode() * 256
+    started = time.perf_counter()
+    try:
+        response = await client.post("/api/upload", files={"file": ("bench.txt", content, "text/plain")})
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+    except Exception as e:
+        recorder.error("POST /api/upload", repr(e))
+        return
+    recorder.record("POST /api/upload", time.perf_counter() - started)
+
+    if not wait_for_job:
+        return
+    try:
+        while True:
+            job = (await client.get(f"/api/upload/jobs/{job_id}")).json()
+            if job["status"] in ("succeeded", "failed"):
+                break
+            await asyncio.sleep(0.2)
+        if job["status"] == "failed":
+            raise RuntimeError(job["error"])
+    except Exception as e:
+        recorder.error("upload job (end to end)", repr(e))
+        return
+    recorder.record("upload job (end to end)", time.perf_counter() - started)
+
+
+async def run_workload(base_url, workloads, total_requests, concurrency, wait_for_jobs):
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(concurrency)
+    operations = {
+        "chat": chat_once,
+        "files": files_once,
+        "upload": lambda client, recorder: upload_once(client, recorder, wait_for_jobs),
+    }
+
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        async def one(index):
+            async with semaphore:
+                await operations[workloads[index % len(workloads)]](client, recorder)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(total_requests)))
+        wall_seconds = time.perf_counter() - started
+
+    return {
+        "config": {
+            "base_url": base_url,
+            "workloads": workloads,
+            "requests": total_requests,
+            "concurrency": concurrency,
+        },
+        "wall_seconds": wall_seconds,
+        "endpoints": recorder.summary(wall_seconds),
+    }
+
+
+def _start_server(module, port, env):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+async def _wait_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+async def main(args):
+    processes = []
+    base_url = args.backend_url
+    try:
+        if not base_url:
+            fake_url = f"http://127.0.0.1:{args.fake_port}"
+            server_env = {**os.environ}
+            processes.append(_start_server("benchmarks.fake_backend:app", args.fake_port, server_env))
+            await _wait_ready(f"{fake_url}/v1/files")
+
+            # バックエンドのOpenAIクライアントとAIKO呼び出しをスタブサーバーに向ける
+            backend_env = {
+                **os.environ,
+                "OPENAI_API_KEY": "sk-benchmark",
+                "OPENAI_BASE_URL": f"{fake_url}/v1",
+                "ASSISTANT_ID": "",
+                "AIKO_API_DOMAIN": f"{fake_url}/aiko",
+                "AIKO_API_KEY": "benchmark",
+                "AIKO_CONVERSATION_ID": "conv_benchmark",
+                "DATA_DIR": tempfile.mkdtemp(prefix="jurac-bench-"),
+            }
+            processes.append(_start_server("main:app", args.backend_port, backend_env))
+            base_url = f"http://127.0.0.1:{args.backend_port}"
+            await _wait_ready(f"{base_url}/api/system-info")
+
+        result = await run_workload(
+            base_url,
+            args.workloads.split(","),
+            args.requests,
+            args.concurrency,
+            not args.no_wait_jobs,
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load test for the JURAC backend")
+    parser.add_argument("--backend-url", help="既に起動済みのバックエンドのURL (省略時はスタブと共に起動)")
+    parser.add_argument("--workloads", default="chat,files,upload", help="chat, files, uploadのカンマ区切り")
+    parser.add_argument("--requests", type=int, default=100, help="送信するリクエストの総数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時実行数")
+    parser.add_argument("--fake-port", type=int, default=8100)
+    parser.add_argument("--backend-port", type=int, default=8001)
+    parser.add_argument("--no-wait-jobs", action="store_true", help="アップロードジョブの完了を待たない")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
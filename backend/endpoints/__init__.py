@@ -3,7 +3,11 @@ from endpoints import (
     assistants,
     chat,
     files,
+    metrics,
+    profiles,
     system_info,
+    threads,
+    traces,
     vector_stores,
 )
 
@@ -11,5 +15,9 @@ router = APIRouter(prefix="/api")
 router.include_router(assistants.router, tags=["assistants"])
 router.include_router(chat.router, tags=["chat"])
 router.include_router(files.router, tags=["files"])
+router.include_router(metrics.router, tags=["metrics"])
+router.include_router(profiles.router, tags=["profiles"])
 router.include_router(system_info.router, tags=["system_info"])
+router.include_router(threads.router, tags=["threads"])
+router.include_router(traces.router, tags=["traces"])
 router.include_router(vector_stores.router, tags=["vector_stores"])
@@ -20,7 +20,7 @@ async def initialize_assistant(request: dict):
             try:
                 # 既存のアシスタントが有効か確認
                 existing_assistant = await client.beta.assistants.retrieve(assistant.assistant_id)
-                logger.info(f"Reusing existing assistant: {existing_assistant.id}")
+                logger.info("Reusing existing assistant: %s", existing_assistant.id)
 
                 # 新しいスレッドを作成
                 thread = await client.beta.threads.create()
@@ -32,7 +32,7 @@ async def initialize_assistant(request: dict):
                     "reused": True
                 }
             except Exception as e:
-                logger.warning(f"Failed to retrieve existing assistant: {str(e)}")
+                logger.warning("Failed to retrieve existing assistant: %s", e)
                 assistant.assistant_id = None  # リット
 
         # 新しいアシスタントを作成
@@ -60,7 +60,7 @@ async def initialize_assistant(request: dict):
             "reused": False
         }
     except Exception as e:
-        logger.error(f"Error initializing assistant: {str(e)}")
+        logger.error("Error initializing assistant: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -74,11 +74,11 @@ async def check_assistant():
                 await client.beta.assistants.retrieve(assistant.assistant_id)
                 return {"assistant_id": assistant.assistant_id}
             except Exception as e:
-                logger.warning(f"Failed to retrieve assistant: {str(e)}")
+                logger.warning("Failed to retrieve assistant: %s", e)
                 assistant.assistant_id = None  # 無効なアシスタントIDをリセット
 
         return {"assistant_id": None}
 
     except Exception as e:
-        logger.error(f"Error checking assistant: {str(e)}")
+        logger.error("Error checking assistant: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -3,12 +3,36 @@ import base64
 from datetime import datetime
 import json
 import os
+import time
 from typing import Optional, List
-from fastapi import APIRouter
+import openai
+from fastapi import APIRouter, Header, HTTPException, Request
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from services.openai import call_dxa_factory, client, get_assistant
-from utils.log import logger
+from services.event_stream import event_streams, stream_lines
+from services.file_index import file_index, sha256_digest
+from services.openai import (
+    call_dxa_factory,
+    client,
+    download_client,
+    get_assistant,
+    polling_client,
+    project_dxa_response,
+    upload_client,
+)
+from services.run_trace import run_trace_store
+from services.thread_history import thread_history
+from settings import const, env
+from utils.log import bind_log_context, logger, reset_log_context
+from utils.metrics import (
+    CHAT_POLL_ITERATIONS,
+    CHAT_RUNS,
+    CHAT_RUNS_IN_FLIGHT,
+    CHAT_STAGE_DURATION,
+    TOKENS,
+)
+from utils.tracing import annotate_trace, begin_trace, end_trace, trace_stage
+from utils.stream_codec import negotiate_compressor
 
 router = APIRouter()
 
@@ -16,6 +40,15 @@ class Message(BaseModel):
     text: str = ""
     content: Optional[List] = None
     model: str | None = None
+    # DXAイベントの形式 ("compact" または "full")。未指定時は環境変数の設定に従う
+    dxa_payload: str | None = None
+
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+    model: str | None = None
+    # 同時に実行する質問数。未指定時や上限を超える場合は BATCH_CONCURRENCY
+    concurrency: int | None = None
 
 
 # ストリーミングイベントの種類を定義
@@ -23,11 +56,36 @@ class StreamingEvent:
     THINKING = "thinking"
     FUNCTION_CALL = "function_call"
     DXA_FACTORY = "dxa_factory"
+    BATCH_RESULT = "batch_result"
     COMPLETE = "complete"
 
 
+def _stream_response(stream, request: Request, last_event_id: int = 0):
+    headers = {"X-Stream-Id": stream.stream_id, "Vary": "Accept-Encoding"}
+    compressor = negotiate_compressor(
+        request.headers.get("accept-encoding"),
+        enabled=env.STREAM_COMPRESSION_ENABLED,
+        level=env.STREAM_COMPRESSION_LEVEL,
+    )
+    if compressor:
+        headers["Content-Encoding"] = compressor.encoding
+    return StreamingResponse(
+        stream_lines(stream, last_event_id, compressor),
+        media_type="text/event-stream",
+        headers=headers
+    )
+
+
+def _event_stream_response(source, request: Request):
+    """
+    イベント生成をバックグラウンドで開始し、採番済みのイベントをNDJSONで返す。
+    接続が切れた場合は X-Stream-Id と最後に受信したイベントIDで再開できる。
+    """
+    return _stream_response(event_streams.start(source), request)
+
+
 @router.post("/chat")
-async def chat(message: Message):
+async def chat(message: Message, request: Request):
     try:
         if message.model:
             assistant = await get_assistant(message.model)
@@ -57,25 +115,16 @@ async def chat(message: Message):
                         f"Vector Store ID: {assistant.vector_store_id}"
                     )
 
-                    return StreamingResponse(
-                        stream_single_response(info_text),
-                        media_type="text/event-stream"
-                    )
+                    return _event_stream_response(stream_single_response(info_text), request)
                 except Exception as e:
-                    logger.error(f"Error retrieving assistant information: {str(e)}")
-                    return StreamingResponse(
-                        stream_single_response(f"Error: {str(e)}"),
-                        media_type="text/event-stream"
-                    )
+                    logger.error("Error retrieving assistant information: %s", e)
+                    return _event_stream_response(stream_single_response(f"Error: {str(e)}"), request)
 
             if command_lower.startswith('/inst '):
                 try:
                     new_instructions = text_content[6:].strip()
                     if not new_instructions:
-                        return StreamingResponse(
-                            stream_single_response("Error: Instructions cannot be empty"),
-                            media_type="text/event-stream"
-                        )
+                        return _event_stream_response(stream_single_response("Error: Instructions cannot be empty"), request)
 
                     updated_assistant = await client.beta.assistants.update(
                         assistant_id=assistant.assistant_id,
@@ -87,16 +136,10 @@ async def chat(message: Message):
                         f"New Instructions: {updated_assistant.instructions}"
                     )
 
-                    return StreamingResponse(
-                        stream_single_response(info_text),
-                        media_type="text/event-stream"
-                    )
+                    return _event_stream_response(stream_single_response(info_text), request)
                 except Exception as e:
-                    logger.error(f"Error updating assistant instructions: {str(e)}")
-                    return StreamingResponse(
-                        stream_single_response(f"Error: {str(e)}"),
-                        media_type="text/event-stream"
-                    )
+                    logger.error("Error updating assistant instructions: %s", e)
+                    return _event_stream_response(stream_single_response(f"Error: {str(e)}"), request)
 
             content.append({"type": "text", "text": text_content})
 
@@ -111,38 +154,45 @@ async def chat(message: Message):
                     # バイナリデータに変換
                     image_data = base64.b64decode(base64_data)
 
-                    # 一時ファイルとして保存
-                    temp_file_path = f"temp_image_{len(content)}.png"
-                    with open(temp_file_path, "wb") as f:
-                        f.write(image_data)
-
-                    # OpenAIにファイルをアップロード
-                    with open(temp_file_path, "rb") as f:
-                        file_response = await client.files.create(
-                            file=f,
+                    # 同じ画像がアップロード済みであれば既存のfile_idを再利用する
+                    image_hash = await sha256_digest(image_data)
+                    entry = await file_index.lookup(image_hash)
+                    file_id = None
+                    if entry:
+                        try:
+                            # OpenAI側で削除済みの場合は再アップロードする
+                            file_id = (await client.files.retrieve(entry["file_id"])).id
+                            logger.info("Reusing uploaded image: %s", file_id)
+                        except openai.NotFoundError:
+                            logger.info("Uploaded image %s no longer exists, uploading again", entry["file_id"])
+                            await file_index.remove_file(entry["file_id"])
+                    if not file_id:
+                        # OpenAIにファイルをアップロード (一時ファイルを経由せずメモリから送信)
+                        file_response = await upload_client.files.create(
+                            file=(f"image_{image_hash[:16]}.png", image_data),
                             purpose="assistants"
                         )
-
-                    # 一時ファイルを削除
-                    os.remove(temp_file_path)
+                        file_id = file_response.id
+                        await file_index.record(image_hash, file_id, f"image_{image_hash[:16]}.png")
 
                     # ファイルURLを使用
                     content.append({
                         "type": "image_file",
                         "image_file": {
-                            "file_id": file_response.id
+                            "file_id": file_id
                         }
                     })
                 else:
                     content.append(item)
 
         # メッセージを作成して送信
-        return StreamingResponse(
-            stream_chat_response(content, assistant),
-            media_type="text/event-stream"
+        dxa_payload = message.dxa_payload or env.DXA_EVENT_PAYLOAD
+        return _event_stream_response(
+            stream_chat_response(content, assistant, dxa_payload),
+            request
         )
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
+        logger.error("Error in chat endpoint: %s", e)
         return JSONResponse(
             status_code=500,
             content={
@@ -156,49 +206,119 @@ async def chat(message: Message):
         )
 
 
-async def stream_chat_response(message_content: str | list, assistant):
+@router.post("/chat/batch")
+async def chat_batch(batch: BatchRequest, request: Request):
+    """
+    複数の質問をそれぞれ新しいスレッドで並列に実行し、
+    完了した順に入力のインデックス付きでNDJSONとして返す。
+    """
+    questions = [question.strip() for question in batch.questions]
+    if not questions or any(not question for question in questions):
+        raise HTTPException(status_code=400, detail="Questions must not be empty")
+    if len(questions) > env.BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many questions (max {env.BATCH_MAX_QUESTIONS})"
+        )
+
+    try:
+        assistant = await get_assistant(batch.model) if batch.model else await get_assistant()
+    except Exception as e:
+        logger.error("Error in chat batch endpoint: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    concurrency = min(batch.concurrency or env.BATCH_CONCURRENCY, env.BATCH_CONCURRENCY)
+    return _event_stream_response(
+        stream_batch_response(questions, assistant, max(1, concurrency)),
+        request
+    )
+
+
+@router.get("/chat/streams/{stream_id}")
+async def resume_chat_stream(
+    stream_id: str,
+    request: Request,
+    last_event_id: int | None = None,
+    last_event_id_header: str | None = Header(None, alias="Last-Event-ID"),
+):
+    """指定したイベントIDより後のイベントを再送し、実行中であれば続きをライブで返す"""
+    stream = event_streams.get(stream_id)
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+
+    if last_event_id is None:
+        try:
+            last_event_id = int(last_event_id_header) if last_event_id_header else 0
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+
+    # 続きのイベントが既にバッファにない場合は欠落したまま再送せず、410で知らせる
+    if stream.is_evicted(last_event_id):
+        raise HTTPException(status_code=410, detail="Requested events are no longer buffered")
+
+    return _stream_response(stream, request, last_event_id)
+
+
+async def stream_chat_response(
+    message_content: str | list,
+    assistant,
+    dxa_payload: str = const.DXA_PAYLOAD_COMPACT
+):
+    run_started = time.perf_counter()
+    run_outcome = "error"
+    CHAT_RUNS_IN_FLIGHT.labels(model=assistant.model).inc()
+    log_token = bind_log_context(thread_id=assistant.conversation_thread)
+    trace = begin_trace("chat", assistant.model)
+    annotate_trace(thread_id=assistant.conversation_thread)
     try:
         thread_id = assistant.conversation_thread
         assistant_id = assistant.assistant_id
         # 初期のthinkingイベント
-        yield json.dumps({
+        yield {
             "type": StreamingEvent.THINKING,
             "data": "Thinking..."
-        }) + "\n"
+        }
 
         # DXA function call tracking
         has_dxa_response = False
 
         # メッセージを作成
-        await client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=message_content
-        )
+        with trace_stage("messages_create"):
+            await client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=message_content
+            )
+        thread_history.invalidate(thread_id)
 
         # 実行を開始
-        run = await client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=assistant_id,
-            model=assistant.model,
-            tool_choice="auto"
-        )
-
-        while True:
-            run_status = await client.beta.threads.runs.retrieve(
+        with trace_stage("runs_create"):
+            run = await client.beta.threads.runs.create(
                 thread_id=thread_id,
-                run_id=run.id
+                assistant_id=assistant_id,
+                model=assistant.model,
+                tool_choice="auto"
             )
+        bind_log_context(run_id=run.id)
+        annotate_trace(run_id=run.id)
+
+        while True:
+            with trace_stage("poll", aggregate=True):
+                run_status = await polling_client.beta.threads.runs.retrieve(
+                    thread_id=thread_id,
+                    run_id=run.id
+                )
+            CHAT_POLL_ITERATIONS.labels(model=assistant.model).inc()
 
             if run_status.status == "requires_action":
                 tool_calls = run_status.required_action.submit_tool_outputs.tool_calls
                 for tool_call in tool_calls:
                     if tool_call.type == "function":
                         # Function呼び出し時のイベント
-                        yield json.dumps({
+                        yield {
                             "type": StreamingEvent.FUNCTION_CALL,
                             "data": tool_call.function.name
-                        }) + "\n"
+                        }
 
                         # Function実行結果を処理
                         tool_outputs = []
@@ -206,18 +326,22 @@ async def stream_chat_response(message_content: str | list, assistant):
                             has_dxa_response = True  # Set flag for DXA response
                             try:
                                 arg = json.loads(tool_call.function.arguments)
-                                dxa_response = call_dxa_factory(arg['question'])
-                                yield json.dumps({
+                                with trace_stage("dxa_call"):
+                                    dxa_response = await call_dxa_factory(arg['question'], thread_id)
+                                yield {
                                     "type": StreamingEvent.DXA_FACTORY,
-                                    "data": dxa_response
-                                }) + "\n"
+                                    "data": (
+                                        dxa_response if dxa_payload == const.DXA_PAYLOAD_FULL
+                                        else project_dxa_response(dxa_response)
+                                    )
+                                }
                                 answer = dxa_response['answer']['response']['task_result']['content']
                                 tool_outputs.append({
                                     "tool_call_id": tool_call.id,
                                     "output": answer if answer else "該当する決算情報が見つかりませんでした。"
                                 })
                             except Exception as e:
-                                logger.error(f"Error in call_dxa_factory: {str(e)}")
+                                logger.error("Error in call_dxa_factory: %s", e)
                                 tool_outputs.append({
                                     "tool_call_id": tool_call.id,
                                     "output": "決算情報の処理中にエラーが発生しました。"
@@ -225,17 +349,24 @@ async def stream_chat_response(message_content: str | list, assistant):
 
                 # ツール実行結果を送信
                 if tool_outputs:
-                    await client.beta.threads.runs.submit_tool_outputs(
-                        thread_id=thread_id,
-                        run_id=run.id,
-                        tool_outputs=tool_outputs
-                    )
+                    with trace_stage("submit_tool_outputs"):
+                        await client.beta.threads.runs.submit_tool_outputs(
+                            thread_id=thread_id,
+                            run_id=run.id,
+                            tool_outputs=tool_outputs
+                        )
 
             elif run_status.status == "completed":
                 # 完了時の処理
-                messages = await client.beta.threads.messages.list(
-                    thread_id=thread_id
-                )
+                run_outcome = run_status.status
+                if run_status.usage:
+                    TOKENS.labels(model=assistant.model, type="prompt").inc(run_status.usage.prompt_tokens)
+                    TOKENS.labels(model=assistant.model, type="completion").inc(run_status.usage.completion_tokens)
+
+                with trace_stage("messages_list"):
+                    messages = await client.beta.threads.messages.list(
+                        thread_id=thread_id
+                    )
                 assistant_message = next((msg for msg in messages.data if msg.role == "assistant"), None)
 
                 if assistant_message:
@@ -254,10 +385,11 @@ async def stream_chat_response(message_content: str | list, assistant):
 
                     # ダウンロードされたファイル情報を処理
                     downloaded_files = []
+                    download_started = time.perf_counter()
                     for file_id in file_ids_to_download:
                         try:
                             file_metadata = await client.files.retrieve(file_id)
-                            file_content = await client.files.content(file_id)
+                            file_content = await download_client.files.content(file_id)
 
                             # ダウンロードディレクトリを作成
                             download_dir = "./downloaded_files"
@@ -274,7 +406,16 @@ async def stream_chat_response(message_content: str | list, assistant):
                                 "path": file_path
                             })
                         except Exception as e:
-                            logger.error(f"Error downloading file {file_id}: {str(e)}")
+                            logger.error("Error downloading file %s: %s", file_id, e)
+                    if file_ids_to_download:
+                        CHAT_STAGE_DURATION.labels(stage="file_download").observe(
+                            time.perf_counter() - download_started
+                        )
+                        trace.add_span(
+                            "file_download",
+                            trace.offset(download_started),
+                            time.perf_counter() - download_started
+                        )
 
                     response = {
                         "type": StreamingEvent.COMPLETE,
@@ -289,12 +430,13 @@ async def stream_chat_response(message_content: str | list, assistant):
                             "isDxaResponse": has_dxa_response
                         }
                     }
-                    logger.info(f"Sending response with isDxaResponse: {has_dxa_response}")
-                    yield json.dumps(response) + "\n"
+                    logger.info("Sending response with isDxaResponse: %s", has_dxa_response)
+                    yield response
                 break
 
             elif run_status.status in ["failed", "cancelled", "expired"]:
-                yield json.dumps({
+                run_outcome = run_status.status
+                yield {
                     "type": StreamingEvent.COMPLETE,
                     "data": {
                         "text": f"Error: Run failed with status {run_status.status}",
@@ -304,14 +446,14 @@ async def stream_chat_response(message_content: str | list, assistant):
                             "total_tokens": 0
                         }
                     }
-                }) + "\n"
+                }
                 break
 
             await asyncio.sleep(0.5)
 
     except Exception as e:
-        logger.error(f"Error in stream_chat_response: {str(e)}")
-        yield json.dumps({
+        logger.error("Error in stream_chat_response: %s", e)
+        yield {
             "type": StreamingEvent.COMPLETE,
             "data": {
                 "text": f"Error: {str(e)}",
@@ -321,19 +463,112 @@ async def stream_chat_response(message_content: str | list, assistant):
                     "total_tokens": 0
                 }
             }
-        }) + "\n"
+        }
+    finally:
+        # Runの終了 (完了・失敗) でアシスタントの返信が追加されるため履歴のキャッシュを破棄する
+        thread_history.invalidate(assistant.conversation_thread)
+        reset_log_context(log_token)
+        end_trace(trace, run_outcome)
+        # Run Stepの取得と保存はバックグラウンドで行う
+        run_trace_store.record(trace)
+        CHAT_RUNS_IN_FLIGHT.labels(model=assistant.model).dec()
+        CHAT_RUNS.labels(model=assistant.model, status=run_outcome).inc()
+        CHAT_STAGE_DURATION.labels(stage="total").observe(time.perf_counter() - run_started)
+
+
+# 中断されたバッチのRunを取り消すタスク (完了まで参照を保持する)
+_run_cancellations = set()
+
+
+async def _cancel_run(trace):
+    try:
+        await client.beta.threads.runs.cancel(thread_id=trace.thread_id, run_id=trace.run_id)
+        logger.info("Cancelled run %s of aborted batch", trace.run_id)
+    except Exception as e:
+        # 取り消す前に完了したRunなど
+        logger.warning("Error cancelling batch run %s: %s", trace.run_id, e)
+
+
+async def _cancel_runs(traces: list):
+    await asyncio.gather(*(_cancel_run(trace) for trace in traces))
+
+
+async def stream_batch_response(questions: list[str], assistant, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    traces = {}
+
+    async def answer(index: int, question: str) -> dict:
+        async with semaphore:
+            # 各質問は別のタスクで実行されるため、トレースも質問毎に分かれる
+            trace = begin_trace("batch", assistant.model)
+            traces[index] = trace
+            status = "failed"
+            try:
+                result = await assistant.answer_question(question)
+                status = "completed"
+                return {"index": index, "question": question, "status": "succeeded", **result}
+            except asyncio.CancelledError:
+                status = "cancelled"
+                raise
+            except Exception as e:
+                logger.error("Error in batch question %s: %s", index, e)
+                return {"index": index, "question": question, "status": "failed", "error": str(e)}
+            finally:
+                end_trace(trace, status)
+                run_trace_store.record(trace)
+
+    yield {
+        "type": StreamingEvent.THINKING,
+        "data": f"Processing {len(questions)} questions..."
+    }
+
+    tasks = [asyncio.create_task(answer(index, question)) for index, question in enumerate(questions)]
+    succeeded = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            if result["status"] == "succeeded":
+                succeeded += 1
+            yield {
+                "type": StreamingEvent.BATCH_RESULT,
+                "data": result
+            }
+    finally:
+        # 途中で中断された場合は残りの質問を取り消す
+        unfinished = [index for index, task in enumerate(tasks) if not task.done()]
+        for index in unfinished:
+            tasks[index].cancel()
+        # OpenAI側で実行中のRunも取り消す (再度キャンセルされても取り消しは続けるよう別タスクで行う)
+        runs = [traces[index] for index in unfinished if index in traces and traces[index].run_id]
+        if runs:
+            cancellation = asyncio.create_task(_cancel_runs(runs))
+            _run_cancellations.add(cancellation)
+            cancellation.add_done_callback(_run_cancellations.discard)
+            try:
+                await asyncio.shield(cancellation)
+            except asyncio.CancelledError:
+                pass
+
+    yield {
+        "type": StreamingEvent.COMPLETE,
+        "data": {
+            "total": len(questions),
+            "succeeded": succeeded,
+            "failed": len(questions) - succeeded
+        }
+    }
 
 
 async def stream_single_response(text: str):
     """
     単一のレスポンスをストリーミング形式で返す補助関数
     """
-    yield json.dumps({
+    yield {
         "type": StreamingEvent.THINKING,
         "data": "Processing command..."
-    }) + "\n"
+    }
 
-    yield json.dumps({
+    yield {
         "type": StreamingEvent.COMPLETE,
         "data": {
             "text": text,
@@ -343,4 +578,4 @@ async def stream_single_response(text: str):
                 "total_tokens": 0
             }
         }
-    }) + "\n"
+    }
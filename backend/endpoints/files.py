@@ -1,7 +1,9 @@
 import base64
 from fastapi import APIRouter, File, HTTPException, UploadFile
 from fastapi.responses import JSONResponse, Response
-from services.openai import get_assistant, client
+from services.file_index import file_index
+from services.ingestion import ingestion_queue
+from services.openai import download_client, get_assistant, client
 from utils.log import logger
 
 router = APIRouter()
@@ -30,11 +32,11 @@ async def list_files():
                         "filename": file_metadata.filename  # メタデータからファイル名を取得
                     })
                 except Exception as e:
-                    logger.warning(f"File with ID {file.id} could not be retrieved: {str(e)}")
+                    logger.warning("File with ID %s could not be retrieved: %s", file.id, e)
 
         return {"files": file_list}
     except Exception as e:
-        logger.error(f"Error listing files: {str(e)}")
+        logger.error("Error listing files: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -47,15 +49,21 @@ async def delete_file(file_id: str):
             vector_store_id=assistant.vector_store_id,
             file_id=file_id
         )
+        # ファイル本体の削除に失敗してもインデックスがVector Storeの状態とずれないよう、先に反映する
+        if deleted_vector_store_file.deleted:
+            await file_index.remove_from_vector_store(file_id, assistant.vector_store_id)
 
         # OpenAI Files APIからファイルを削除
         deleted_openai_file = await client.files.delete(file_id)
 
+        if deleted_openai_file.deleted:
+            await file_index.remove_file(file_id)
+
         if deleted_vector_store_file.deleted and deleted_openai_file.deleted:
             return {"message": "File deleted successfully"}
         raise HTTPException(status_code=400, detail="Failed to delete file")
     except Exception as e:
-        logger.error(f"Error deleting file: {str(e)}")
+        logger.error("Error deleting file: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -77,9 +85,14 @@ async def delete_all_files():
         for file in files.data:
             await client.files.delete(file.id)
 
+        # すべてのファイルを削除したため重複排除インデックスも空にする
+        await file_index.clear()
+
         return {"message": "All files deleted successfully"}
     except Exception as e:
-        logger.error(f"Error deleting all files: {str(e)}")
+        logger.error("Error deleting all files: %s", e)
+        # 途中で失敗した場合も削除済みのfile_idを再利用しないようインデックスを空にする
+        await file_index.clear()
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -88,7 +101,7 @@ async def delete_all_files():
 async def download_file(file_id: str):
     try:
         file_metadata = await client.files.retrieve(file_id)
-        file_content = await client.files.content(file_id)
+        file_content = await download_client.files.content(file_id)
 
         return Response(
             content=file_content.content,
@@ -98,7 +111,7 @@ async def download_file(file_id: str):
             }
         )
     except Exception as e:
-        logger.error(f"Error downloading file: {str(e)}")
+        logger.error("Error downloading file: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -113,15 +126,35 @@ async def upload_file(file: UploadFile = File(...)):
         # ファイルの内容を直接読み込む
         content = await file.read()
 
-        # Vector Storeにアップロード
-        await assistant.upload_file_to_vector_store(content, file.filename)
+        # Vector Storeへの取り込みはバックグラウンドのジョブとして実行する
+        job = await ingestion_queue.enqueue(content, file.filename, assistant.vector_store_id)
 
-        return JSONResponse(content={"message": "File uploaded successfully"})
+        return JSONResponse(
+            status_code=202,
+            content={
+                "message": "File upload queued",
+                "job_id": job.job_id,
+                "status": job.status
+            }
+        )
     except Exception as e:
-        logger.error(f"Error uploading file: {str(e)}")
+        logger.error("Error uploading file: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/upload/jobs")
+async def list_upload_jobs():
+    return {"jobs": [job.to_dict() for job in ingestion_queue.list_jobs()]}
+
+
+@router.get("/upload/jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    job = ingestion_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
 @router.post("/upload-image")
 async def upload_image(file: UploadFile = File(...)):
     try:
@@ -147,5 +180,5 @@ async def upload_image(file: UploadFile = File(...)):
             "url": data_url
         }
     except Exception as e:
-        logger.error(f"Error uploading image: {str(e)}")
+        logger.error("Error uploading image: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
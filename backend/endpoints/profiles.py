@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from utils.log import logger
+from utils.profiler import is_admin_token, profile_store
+
+router = APIRouter()
+
+
+def _require_admin(header_token: str | None, query_token: str | None):
+    if not is_admin_token(header_token or query_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@router.get("/profiles")
+async def list_profiles(
+    x_admin_token: str | None = Header(default=None),
+    admin_token: str | None = Query(default=None),
+):
+    _require_admin(x_admin_token, admin_token)
+    try:
+        return {"profiles": await profile_store.list_profiles()}
+    except Exception as e:
+        logger.error("Error listing profiles: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(
+    profile_id: str,
+    format: str = Query(default="json", pattern="^(json|collapsed)$"),
+    x_admin_token: str | None = Header(default=None),
+    admin_token: str | None = Query(default=None),
+):
+    """
+    プロファイル結果をダウンロードする。
+    format=collapsed の場合はflamegraph.pl / speedscope 用の折り畳み形式のテキストを返す。
+    """
+    _require_admin(x_admin_token, admin_token)
+    try:
+        report = await profile_store.load(profile_id)
+    except Exception as e:
+        logger.error("Error loading profile: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    disposition = {"Content-Disposition": f'attachment; filename="profile_{profile_id}.{"txt" if format == "collapsed" else "json"}"'}
+    if format == "collapsed":
+        lines = [f"{stack} {count}" for stack, count in report["collapsed"].items()]
+        return PlainTextResponse("\n".join(lines) + "\n", headers=disposition)
+    return JSONResponse(report, headers=disposition)
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
-from services.openai import get_assistant
+from services import aiko
+from services.openai import get_assistant, get_pool_stats, vector_store_catalog
 from utils.log import logger
 
 router = APIRouter()
@@ -10,8 +11,14 @@ async def get_system_info():
         assistant = await get_assistant()
         return {
             "assistant_id": assistant.assistant_id,
-            "vector_store_id": assistant.vector_store_id
+            "vector_store_id": assistant.vector_store_id,
+            # Vector Storeの詳細はバックグラウンドで更新される一覧から返す
+            "vector_store": vector_store_catalog.get(assistant.vector_store_id),
+            "vector_store_catalog": vector_store_catalog.status(),
+            "thread_id": assistant.conversation_thread,
+            "dxa_backend": aiko.get_status(),
+            "openai_pool": get_pool_stats()
         }
     except Exception as e:
-        logger.error(f"Error getting system info: {str(e)}")
+        logger.error("Error getting system info: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
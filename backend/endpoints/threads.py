@@ -0,0 +1,48 @@
+import openai
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from services.thread_history import thread_history
+from utils.log import logger
+
+router = APIRouter()
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # 弱いETagとして比較する
+    candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+@router.get("/threads/{thread_id}/messages")
+async def list_thread_messages(
+    thread_id: str,
+    request: Request,
+    limit: int = Query(default=20, ge=1, le=100),
+    order: str = Query(default="desc", pattern="^(asc|desc)$"),
+    after: str | None = None,
+):
+    """
+    スレッドのメッセージをページ単位で返す。
+    次のページは next_cursor を after に指定して取得する。
+    内容が変わっていなければ If-None-Match に対して304を返す。
+    """
+    try:
+        page = await thread_history.get_page(thread_id, limit, order, after)
+    except openai.NotFoundError:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    except Exception as e:
+        logger.error("Error listing thread messages: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # ブラウザのキャッシュを使いつつ、毎回ETagで再検証させる
+    headers = {"ETag": page["etag"], "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), page["etag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(
+        {key: value for key, value in page.items() if key != "etag"},
+        headers=headers
+    )
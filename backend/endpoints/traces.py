@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Query
+from services.run_trace import run_trace_store
+from utils.log import logger
+
+router = APIRouter()
+
+@router.get("/traces")
+async def list_run_traces(
+    thread_id: str | None = None,
+    run_id: str | None = None,
+    limit: int = Query(default=50, ge=1, le=1000),
+):
+    """Runの処理段階とRun Stepのタイムラインを新しい順に返す"""
+    try:
+        return {"traces": await run_trace_store.query(thread_id, run_id, limit)}
+    except Exception as e:
+        logger.error("Error listing run traces: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/traces/summary")
+async def summarize_run_traces(
+    limit: int = Query(default=1000, ge=1, le=100000),
+    source: str | None = Query(default=None, pattern="^(chat|batch)$"),
+):
+    """直近のRunでどの段階に時間がかかっているかを集計する"""
+    try:
+        return await run_trace_store.summary(limit, source)
+    except Exception as e:
+        logger.error("Error summarizing run traces: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,23 +1,29 @@
 from fastapi import APIRouter, HTTPException
-from services.openai import client
+from services.openai import vector_store_catalog
 from utils.log import logger
 
 router = APIRouter()
 
 @router.get("/vector-stores")
 async def list_vector_stores():
+    # バックグラウンドで更新される一覧を返す (OpenAIへの問い合わせは行わない)
     try:
-        vector_stores = await client.beta.vector_stores.list()
         return {
-            "vector_stores": [
-                {
-                    "id": store.id,
-                    "name": store.name,
-                    "created_at": store.created_at
-                }
-                for store in vector_stores.data
-            ]
+            "vector_stores": await vector_store_catalog.list_stores(),
+            **vector_store_catalog.status()
         }
     except Exception as e:
-        logger.error(f"Error listing vector stores: {str(e)}")
+        logger.error("Error listing vector stores: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/vector-stores/refresh")
+async def refresh_vector_stores():
+    try:
+        return {
+            "vector_stores": await vector_store_catalog.refresh(),
+            **vector_store_catalog.status()
+        }
+    except Exception as e:
+        logger.error("Error refreshing vector stores: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
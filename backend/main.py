@@ -1,10 +1,16 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import aiofiles
 from endpoints import router
-from services.openai import get_assistant
+from services.ingestion import ingestion_queue
+from services.openai import get_assistant, vector_store_catalog
+from settings import env
 from utils.log import logger
+from utils.loop_monitor import loop_monitor
+from utils.profiler import ProfilingMiddleware
+from utils.request_context import RequestContextMiddleware
 
 app = FastAPI()
 
@@ -14,21 +20,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id", "X-Profile-Id", "X-Request-Id"],
 )
+app.add_middleware(RequestContextMiddleware)
+app.add_middleware(ProfilingMiddleware)
 
 app.include_router(router)
 
 # サーバー起動時の初期化関数
 @app.on_event("startup")
 async def startup_event():
+    if env.LOOP_MONITOR_ENABLED:
+        loop_monitor.start(asyncio.get_running_loop())
     try:
         assistant = await get_assistant()
         logger.info("Assistant initialization completed successfully")
+        vector_store_catalog.start()
+        await ingestion_queue.start()
     except Exception as e:
         logger.error("Error initializing assistant on startup: %s", e)
         raise
 
 
+# サーバー停止時の終了処理
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingestion_queue.stop()
+    await vector_store_catalog.stop()
+    loop_monitor.stop()
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
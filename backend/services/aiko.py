@@ -0,0 +1,430 @@
+import asyncio
+import bisect
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import httpx
+from settings import env
+from utils.log import log_payload, logger
+from utils.metrics import DXA_REQUEST_DURATION
+
+
+class DxaUnavailableError(Exception):
+    """DXAバックエンド (AIKO) が利用できない場合のエラー"""
+
+
+class LatencyTracker:
+    """直近のレイテンシを保持し、パーセンタイルを計算する"""
+
+    def __init__(self, window: int, min_samples: int):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        # サンプル数が少ない間は信頼できないためNoneを返す
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """
+    連続した失敗がしきい値を超えるとOPENになり、一定時間リクエストを即座に失敗させる。
+    reset_timeout経過後はHALF_OPENとして1件だけ試行し、成功すればCLOSEDに戻る。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.rejected_count = 0
+        self.last_failure = None
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+
+        self.rejected_count += 1
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("DXA circuit breaker closed")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """キャンセルなどで結果が出なかった試行の枠を返す (状態は変えない)"""
+        self._probe_in_flight = False
+
+    def record_failure(self, error: Exception):
+        self.consecutive_failures += 1
+        self.last_failure = str(error) or type(error).__name__
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("DXA circuit breaker opened after %d failures", self.consecutive_failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        retry_in = None
+        if self.state == self.OPEN:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "rejected_count": self.rejected_count,
+            "retry_in_seconds": retry_in,
+            "last_failure": self.last_failure,
+        }
+
+
+class HedgeBudget:
+    """直近window件のリクエストのうち、ヘッジを送信した割合をratio以下に抑える"""
+
+    def __init__(self, ratio: float, window: int):
+        self.ratio = ratio
+        self.window = window
+        self.request_count = 0
+        # ヘッジを送信したリクエストの通し番号 (window件より古いものは取り除く)
+        self._hedged = []
+        self.exhausted_count = 0
+
+    def record_request(self) -> int:
+        """リクエストを数え、try_acquireに渡す通し番号を返す"""
+        self.request_count += 1
+        return self.request_count
+
+    def try_acquire(self, sequence: int) -> bool:
+        oldest = self.request_count - self.window
+        while self._hedged and self._hedged[0] <= oldest:
+            self._hedged.pop(0)
+        # 許可する毎に必ず1件追加するため、同時に判定してもratioを超えない
+        if len(self._hedged) + 1 > self.ratio * min(self.request_count, self.window):
+            self.exhausted_count += 1
+            return False
+        # 遅いリクエストほど後から許可されるため、番号順に挿入する
+        bisect.insort(self._hedged, sequence)
+        return True
+
+
+latency_tracker = LatencyTracker(
+    window=env.DXA_LATENCY_WINDOW,
+    min_samples=env.DXA_HEDGE_MIN_SAMPLES,
+)
+circuit_breaker = CircuitBreaker(
+    failure_threshold=env.DXA_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=env.DXA_BREAKER_RESET_SECONDS,
+)
+hedge_budget = HedgeBudget(
+    ratio=env.DXA_HEDGE_BUDGET_RATIO,
+    window=env.DXA_LATENCY_WINDOW,
+)
+hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+
+_http_client = httpx.AsyncClient(timeout=env.AIKO_TIMEOUT_SECONDS)
+
+
+def _headers() -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {env.AIKO_API_KEY}"
+    }
+
+
+class AikoConversation:
+    def __init__(self, conversation_id: str):
+        self.id = conversation_id
+        self.message_count = 0
+        self.leased = False
+
+
+class ConversationPool:
+    """
+    AIKOの会話IDをプールし、呼び出し毎に排他的に貸し出す。
+    同じセッション (OpenAIのスレッド) には可能な限り同じ会話を割り当て、
+    max_messages件を超えた会話は新しい会話に入れ替えて履歴の肥大化を防ぐ。
+    """
+
+    def __init__(self, seed_ids: list[str], max_size: int, max_messages: int, max_sessions: int = 1000,
+                 create_backoff: float = 30.0):
+        self.max_size = max(max_size, len(seed_ids), 1)
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.create_backoff = create_backoff
+        # 会話の作成に失敗した場合、この時刻までは作成を試みない
+        self._create_retry_at = 0.0
+        self.conversations = [AikoConversation(conversation_id) for conversation_id in seed_ids]
+        self.rotated_count = 0
+        self._sessions: OrderedDict[str, AikoConversation] = OrderedDict()
+        self._creating = 0
+        self._condition = asyncio.Condition()
+
+    def _is_exhausted(self, conversation: AikoConversation) -> bool:
+        return self.max_messages > 0 and conversation.message_count >= self.max_messages
+
+    def _pick_idle(self, session_key: str | None) -> AikoConversation | None:
+        bound = self._sessions.get(session_key) if session_key else None
+        if bound and not bound.leased and bound in self.conversations:
+            return bound
+        idle = [conversation for conversation in self.conversations if not conversation.leased]
+        if not idle:
+            return None
+        # 他のセッションに割り当て済みでない、履歴の短い会話を優先する
+        bound_ids = {conversation.id for conversation in self._sessions.values()}
+        return min(idle, key=lambda c: (c.id in bound_ids, c.message_count))
+
+    async def _create_conversation(self) -> AikoConversation:
+        response = await _http_client.post(
+            f'{env.AIKO_API_DOMAIN}/conversations',
+            headers=_headers(),
+            json={}
+        )
+        response.raise_for_status()
+        data = response.json()
+        conversation_id = data.get("id") or data.get("conversation_id")
+        if not conversation_id:
+            raise DxaUnavailableError(f"unexpected create conversation response: {data}")
+        logger.info("Created AIKO conversation: %s", conversation_id)
+        return AikoConversation(conversation_id)
+
+    async def _replace(self, exhausted: AikoConversation | None) -> AikoConversation | None:
+        """新しい会話を作成してプールに追加する。作成できない場合はNoneを返す"""
+        try:
+            conversation = await self._create_conversation()
+        except Exception as e:
+            logger.warning("Failed to create AIKO conversation: %s", e)
+            conversation = None
+
+        async with self._condition:
+            self._creating -= 1
+            if conversation is None:
+                self._create_retry_at = time.monotonic() + self.create_backoff
+            if conversation:
+                conversation.leased = True
+                self.conversations.append(conversation)
+                if exhausted:
+                    self.conversations.remove(exhausted)
+                    self.rotated_count += 1
+            self._condition.notify_all()
+        return conversation
+
+    async def acquire(self, session_key: str | None = None) -> AikoConversation:
+        while True:
+            async with self._condition:
+                conversation = self._pick_idle(session_key)
+                backoff = self._create_retry_at - time.monotonic()
+                if conversation and (not self._is_exhausted(conversation) or backoff > 0):
+                    # 作成に失敗した直後は、上限に達した会話も入れ替えずにそのまま使う
+                    conversation.leased = True
+                    break
+                if conversation is None:
+                    if not self.conversations and not self._creating and backoff > 0:
+                        raise DxaUnavailableError("No AIKO conversation available")
+                    if len(self.conversations) + self._creating >= self.max_size or backoff > 0:
+                        # 作成の待機中はbackoff経過後に拡張を再試行する
+                        try:
+                            await asyncio.wait_for(
+                                self._condition.wait(), timeout=backoff if backoff > 0 else None
+                            )
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                # 上限に達した会話の入れ替え、またはプールの拡張
+                exhausted = conversation
+                if exhausted:
+                    exhausted.leased = True
+                self._creating += 1
+
+            created = await self._replace(exhausted)
+            if created:
+                conversation = created
+                break
+            if exhausted:
+                # 作成できない場合は既存の会話を使い続ける (件数は保持し、backoff後に入れ替えを再試行する)
+                conversation = exhausted
+                break
+            # 作成を待つ間に返却された会話があり得るため、ロックを取り直して確認する
+
+        if session_key:
+            self._sessions[session_key] = conversation
+            self._sessions.move_to_end(session_key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return conversation
+
+    async def release(self, conversation: AikoConversation):
+        async with self._condition:
+            conversation.leased = False
+            conversation.message_count += 1
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def lease(self, session_key: str | None = None):
+        conversation = await self.acquire(session_key)
+        try:
+            yield conversation
+        finally:
+            await self.release(conversation)
+
+    def snapshot(self) -> dict:
+        return {
+            "size": len(self.conversations),
+            "max_size": self.max_size,
+            "leased": sum(1 for conversation in self.conversations if conversation.leased),
+            "max_messages": self.max_messages,
+            "rotated_count": self.rotated_count,
+            "sessions": len(self._sessions),
+            "conversations": [
+                {"id": c.id, "message_count": c.message_count, "leased": c.leased}
+                for c in self.conversations
+            ],
+        }
+
+
+conversation_pool = ConversationPool(
+    seed_ids=env.AIKO_CONVERSATION_IDS,
+    max_size=env.AIKO_CONVERSATION_POOL_SIZE,
+    max_messages=env.AIKO_CONVERSATION_MAX_MESSAGES,
+    create_backoff=env.AIKO_CONVERSATION_CREATE_BACKOFF_SECONDS,
+)
+
+
+async def _post_message(query: str, session_key: str | None) -> dict:
+    # ヘッジリクエストも含め、送信毎にプールから会話を借りる
+    async with conversation_pool.lease(session_key) as conversation:
+        url = f'{env.AIKO_API_DOMAIN}/conversations/{conversation.id}/messages/sync'
+        started = time.monotonic()
+        try:
+            response = await _http_client.post(
+                url,
+                headers=_headers(),
+                json={"message": query, "language_code": "ja"}
+            )
+        except asyncio.CancelledError:
+            # ヘッジで不要になったリクエスト
+            DXA_REQUEST_DURATION.labels(outcome="cancelled").observe(time.monotonic() - started)
+            raise
+        except Exception:
+            DXA_REQUEST_DURATION.labels(outcome="error").observe(time.monotonic() - started)
+            raise
+    elapsed = time.monotonic() - started
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        DXA_REQUEST_DURATION.labels(outcome="error").observe(elapsed)
+        logger.error("request failed. error=(%s)", e.response.text)
+        raise DxaUnavailableError(f"request failed. status: {response.status_code}") from e
+    DXA_REQUEST_DURATION.labels(outcome="success").observe(elapsed)
+    latency_tracker.observe(elapsed)
+    data = response.json()
+    log_payload("DXA response", data)
+    return data
+
+
+async def _hedged_post(query: str, session_key: str | None) -> dict:
+    """
+    最初のリクエストが直近のp95より遅い場合に2本目を送信し、先に成功した方を採用する。
+    ヘッジの送信数はhedge_budgetの割合までに制限する。
+    """
+    hedge_stats["requests"] += 1
+    sequence = hedge_budget.record_request()
+    first = asyncio.create_task(_post_message(query, session_key))
+    delay = latency_tracker.percentile(env.DXA_HEDGE_PERCENTILE) if env.DXA_HEDGING_ENABLED else None
+    if delay is None:
+        return await first
+
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+    except asyncio.CancelledError:
+        # asyncio.waitは待機中のタスクをキャンセルしないため、呼び出し元のキャンセルを伝える
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+    if not hedge_budget.try_acquire(sequence):
+        return await first
+
+    logger.info("DXA request slower than p%.0f (%.2fs), sending hedged request",
+                env.DXA_HEDGE_PERCENTILE * 100, delay)
+    hedge_stats["hedged"] += 1
+    second = asyncio.create_task(_post_message(query, session_key))
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        hedge_stats["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def send_message(query: str, session_key: str | None = None) -> dict:
+    """サーキットブレーカーを経由してAIKOにメッセージを送信する"""
+    if not circuit_breaker.allow_request():
+        raise DxaUnavailableError("DXA backend is unavailable (circuit open)")
+
+    try:
+        data = await _hedged_post(query, session_key)
+    except DxaUnavailableError as e:
+        # 4xxはリクエスト側の問題のため、バックエンド障害としては数えない
+        cause = e.__cause__
+        if isinstance(cause, httpx.HTTPStatusError) and cause.response.status_code < 500:
+            circuit_breaker.record_success()
+        else:
+            circuit_breaker.record_failure(e)
+        raise
+    except asyncio.CancelledError:
+        # 結果が出ていないため成功・失敗としては数えず、HALF_OPENの試行枠だけを返す
+        circuit_breaker.release_probe()
+        raise
+    except Exception as e:
+        circuit_breaker.record_failure(e)
+        raise
+
+    circuit_breaker.record_success()
+    return data
+
+
+def get_status() -> dict:
+    p95 = latency_tracker.percentile(env.DXA_HEDGE_PERCENTILE)
+    return {
+        "circuit_breaker": circuit_breaker.snapshot(),
+        "hedging": {
+            "enabled": env.DXA_HEDGING_ENABLED,
+            "hedge_delay_seconds": p95,
+            "budget_ratio": hedge_budget.ratio,
+            "budget_exhausted": hedge_budget.exhausted_count,
+            **hedge_stats,
+        },
+        "conversation_pool": conversation_pool.snapshot(),
+    }
@@ -0,0 +1,136 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator
+from settings import env
+from utils.log import logger
+from utils.stream_codec import dumps_line
+
+
+class EventStream:
+    """
+    1回のチャット実行で発生するイベントを採番し、リングバッファに保持する。
+    クライアントの接続が切れても実行は継続し、再接続時に続きから再送できる。
+    """
+
+    def __init__(self, stream_id: str, buffer_size: int):
+        self.stream_id = stream_id
+        self.events = deque(maxlen=buffer_size)
+        self.last_event_id = 0
+        self.closed = False
+        self.closed_at = None
+        self.task = None
+        self._condition = asyncio.Condition()
+
+    async def publish(self, event: dict):
+        async with self._condition:
+            self.last_event_id += 1
+            self.events.append({
+                "id": self.last_event_id,
+                "stream_id": self.stream_id,
+                **event,
+            })
+            self._condition.notify_all()
+
+    async def close(self):
+        async with self._condition:
+            self.closed = True
+            self.closed_at = time.monotonic()
+            self._condition.notify_all()
+
+    def is_evicted(self, last_event_id: int) -> bool:
+        """last_event_idの次のイベントが既にバッファから押し出されているか"""
+        return bool(self.events) and last_event_id < self.events[0]["id"] - 1
+
+    async def subscribe(self, last_event_id: int = 0) -> AsyncIterator[dict]:
+        """
+        last_event_idより後のイベントを再送し、その後はライブで配信する。
+        バッファから押し出されたイベントがある場合は、欠落した範囲をgapイベントで通知する。
+        """
+        cursor = last_event_id
+
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(
+                    lambda: self.last_event_id > cursor or self.closed
+                )
+                # closedの判定はバッファを読む前に行い、close直前のイベントの取りこぼしを防ぐ
+                closed = self.closed
+                pending = [event for event in self.events if event["id"] > cursor]
+
+            if pending and pending[0]["id"] > cursor + 1:
+                logger.warning(
+                    "Stream %s: events %d-%d already evicted from buffer",
+                    self.stream_id, cursor + 1, pending[0]["id"] - 1
+                )
+                # IDを持たないため、クライアントの重複判定 (最後のイベントID) には影響しない
+                yield {
+                    "stream_id": self.stream_id,
+                    "type": "gap",
+                    "data": {"from_id": cursor + 1, "to_id": pending[0]["id"] - 1},
+                }
+
+            for event in pending:
+                cursor = event["id"]
+                yield event
+
+            if closed and cursor >= self.last_event_id:
+                return
+
+    async def _pump(self, source: AsyncIterator[dict]):
+        try:
+            async for event in source:
+                await self.publish(event)
+        except Exception as e:
+            logger.error("Error in event stream %s: %s", self.stream_id, e)
+        finally:
+            await self.close()
+
+
+class EventStreamRegistry:
+    """実行中および直近に完了したイベントストリームを管理する"""
+
+    def __init__(self, buffer_size: int, retention_seconds: float):
+        self.buffer_size = buffer_size
+        self.retention_seconds = retention_seconds
+        self.streams: dict[str, EventStream] = {}
+
+    def start(self, source: AsyncIterator[dict]) -> EventStream:
+        """イベント生成をバックグラウンドタスクとして開始する"""
+        self._evict_expired()
+        stream = EventStream(uuid.uuid4().hex, self.buffer_size)
+        self.streams[stream.stream_id] = stream
+        stream.task = asyncio.create_task(stream._pump(source))
+        return stream
+
+    def get(self, stream_id: str) -> EventStream | None:
+        self._evict_expired()
+        return self.streams.get(stream_id)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [
+            stream_id for stream_id, stream in self.streams.items()
+            if stream.closed and now - stream.closed_at > self.retention_seconds
+        ]
+        for stream_id in expired:
+            del self.streams[stream_id]
+
+
+async def stream_lines(stream: EventStream, last_event_id: int = 0, compressor=None):
+    """イベントをNDJSONで返す。圧縮する場合もイベント毎にフラッシュする"""
+    if compressor is None:
+        async for event in stream.subscribe(last_event_id):
+            yield dumps_line(event)
+        return
+
+    async for event in stream.subscribe(last_event_id):
+        yield compressor.compress(dumps_line(event))
+    yield compressor.finish()
+
+
+event_streams = EventStreamRegistry(
+    buffer_size=env.EVENT_STREAM_BUFFER_SIZE,
+    retention_seconds=env.EVENT_STREAM_RETENTION_SECONDS,
+)
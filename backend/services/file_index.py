@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import aiofiles
+from settings import env
+from utils.log import logger
+
+# これより大きい内容はイベントループを塞がないようスレッドでハッシュ計算する
+_INLINE_HASH_LIMIT = 1024 * 1024
+
+
+async def sha256_digest(content: bytes) -> str:
+    if len(content) > _INLINE_HASH_LIMIT:
+        return await asyncio.to_thread(lambda: hashlib.sha256(content).hexdigest())
+    return hashlib.sha256(content).hexdigest()
+
+
+class FileIndex:
+    """
+    アップロード済みファイルの内容ハッシュ (SHA-256) からOpenAIのfile_idと
+    Vector Storeへの登録状況を引く永続インデックス。同じ内容の再アップロードを防ぐ。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        try:
+            async with aiofiles.open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.loads(await f.read()).get("files", {})
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            logger.error("Failed to load file index: %s", e)
+            self.entries = {}
+        self._loaded = True
+
+    async def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = json.dumps({"files": self.entries}, ensure_ascii=False)
+        temp_path = f"{self.path}.tmp"
+        async with aiofiles.open(temp_path, "w", encoding="utf-8") as f:
+            await f.write(data)
+        await asyncio.to_thread(os.replace, temp_path, self.path)
+
+    async def lookup(self, sha256: str, purpose: str = "assistants") -> dict | None:
+        async with self._lock:
+            await self._ensure_loaded()
+            entry = self.entries.get(sha256)
+            if entry and entry["purpose"] == purpose:
+                return dict(entry)
+            return None
+
+    async def record(self, sha256: str, file_id: str, filename: str,
+                     purpose: str = "assistants", vector_store_id: str | None = None):
+        async with self._lock:
+            await self._ensure_loaded()
+            entry = self.entries.get(sha256)
+            if not entry or entry["file_id"] != file_id:
+                entry = {
+                    "file_id": file_id,
+                    "filename": filename,
+                    "purpose": purpose,
+                    "vector_store_ids": [],
+                    "created_at": time.time(),
+                }
+                self.entries[sha256] = entry
+            if vector_store_id and vector_store_id not in entry["vector_store_ids"]:
+                entry["vector_store_ids"].append(vector_store_id)
+            await self._save()
+
+    async def remove_from_vector_store(self, file_id: str, vector_store_id: str):
+        async with self._lock:
+            await self._ensure_loaded()
+            for entry in self.entries.values():
+                if entry["file_id"] == file_id and vector_store_id in entry["vector_store_ids"]:
+                    entry["vector_store_ids"].remove(vector_store_id)
+            await self._save()
+
+    async def remove_file(self, file_id: str):
+        async with self._lock:
+            await self._ensure_loaded()
+            self.entries = {
+                sha256: entry for sha256, entry in self.entries.items()
+                if entry["file_id"] != file_id
+            }
+            await self._save()
+
+    async def clear(self):
+        async with self._lock:
+            self.entries = {}
+            self._loaded = True
+            await self._save()
+
+
+file_index = FileIndex(os.path.join(env.DATA_DIR, "file_index.json"))
@@ -0,0 +1,200 @@
+import importlib.util
+import ipaddress
+import time
+from urllib.request import getproxies
+import httpx
+from utils.log import logger
+from utils.metrics import (
+    OPENAI_POOL_CONNECTIONS,
+    OPENAI_POOL_QUEUED_REQUESTS,
+    OPENAI_REQUEST_DURATION,
+    OPENAI_REQUESTS_IN_FLIGHT,
+)
+
+# OpenAI APIのパスのうちリソース名・アクション名として扱うセグメント (それ以外はIDとみなす)
+_RESOURCE_SEGMENTS = {
+    "assistants", "threads", "messages", "runs", "steps", "files", "content",
+    "vector_stores", "file_batches", "cancel", "submit_tool_outputs", "uploads",
+    "parts", "complete", "chat", "completions", "models",
+}
+_ACTION_SEGMENTS = {"cancel", "submit_tool_outputs", "content", "complete"}
+
+
+def openai_operation_name(method: str, path: str) -> str:
+    """
+    リクエストのメソッドとパスからSDKのメソッド名に近い操作名を作る。
+    例: GET /v1/threads/thread_x/runs/run_y -> threads.runs.retrieve
+    """
+    names = []
+    ends_with_id = False
+    for segment in path.strip("/").split("/"):
+        if not segment or segment == "v1":
+            continue
+        if segment in _RESOURCE_SEGMENTS:
+            names.append(segment)
+            ends_with_id = False
+        else:
+            ends_with_id = True
+
+    if names and names[-1] in _ACTION_SEGMENTS and not ends_with_id:
+        return ".".join(names)
+
+    if method == "GET":
+        verb = "retrieve" if ends_with_id else "list"
+    elif method == "POST":
+        verb = "update" if ends_with_id else "create"
+    elif method == "DELETE":
+        verb = "delete"
+    else:
+        verb = method.lower()
+    return ".".join([*names, verb])
+
+
+class MetricsTransport(httpx.AsyncBaseTransport):
+    """下位のトランスポートをラップし、OpenAI APIの操作毎のレイテンシを記録する"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        operation = openai_operation_name(request.method, request.url.path)
+        start = time.perf_counter()
+        try:
+            with OPENAI_REQUESTS_IN_FLIGHT._default().track_inprogress():
+                response = await self._transport.handle_async_request(request)
+        except Exception:
+            OPENAI_REQUEST_DURATION.labels(operation=operation, status="error").observe(
+                time.perf_counter() - start
+            )
+            raise
+        OPENAI_REQUEST_DURATION.labels(operation=operation, status=str(response.status_code)).observe(
+            time.perf_counter() - start
+        )
+        return response
+
+    def pool_stats(self) -> dict:
+        """下位のhttpcoreの接続プールの使用状況 (取得できない場合は空)"""
+        try:
+            return self._pool_stats()
+        except Exception as e:
+            # httpcoreの内部属性を参照しているため、バージョンの違いで失敗しても処理を止めない
+            logger.debug("Could not read OpenAI connection pool stats: %s", e)
+            return {}
+
+    def _pool_stats(self) -> dict:
+        pool = getattr(self._transport, "_pool", None)
+        if pool is None:
+            return {}
+        connections = list(pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        closed = sum(1 for connection in connections if connection.is_closed())
+        http2 = sum(1 for connection in connections if "HTTP/2" in connection.info())
+        queued = sum(1 for pool_request in getattr(pool, "_requests", []) if pool_request.is_queued())
+        return {
+            "connections": len(connections),
+            "active": len(connections) - idle - closed,
+            "idle": idle,
+            "http2_connections": http2,
+            "queued_requests": queued,
+            "in_flight_requests": int(OPENAI_REQUESTS_IN_FLIGHT._default().value),
+            "max_connections": pool._max_connections,
+            "max_keepalive_connections": pool._max_keepalive_connections,
+            "keepalive_expiry": pool._keepalive_expiry,
+        }
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# 接続プール毎の値を合計する項目 (それ以外は設定値または全体の値のため先頭のプールの値を使う)
+_SUMMED_POOL_STATS = ("connections", "active", "idle", "http2_connections", "queued_requests")
+
+
+def combined_pool_stats(transports: list[MetricsTransport]) -> dict:
+    """直接接続とプロキシ経由の接続プールの使用状況を合計する"""
+    combined = {}
+    for stats in filter(None, (transport.pool_stats() for transport in transports)):
+        if not combined:
+            combined = dict(stats)
+            continue
+        for key in _SUMMED_POOL_STATS:
+            combined[key] += stats[key]
+    if combined:
+        combined["pools"] = len(transports)
+    return combined
+
+
+def collect_pool_metrics(transports: list[MetricsTransport]):
+    stats = combined_pool_stats(transports)
+    if not stats:
+        return
+    OPENAI_POOL_CONNECTIONS.labels(state="active").set(stats["active"])
+    OPENAI_POOL_CONNECTIONS.labels(state="idle").set(stats["idle"])
+    OPENAI_POOL_QUEUED_REQUESTS.set(stats["queued_requests"])
+
+
+def build_openai_transport(
+    max_connections: int,
+    max_keepalive_connections: int,
+    keepalive_expiry: float,
+    http2: bool,
+    proxy: str | None = None,
+) -> MetricsTransport:
+    """OpenAIクライアント用の接続プールを作成する。HTTP/2はh2がインストールされている場合のみ有効にする"""
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("OPENAI_HTTP2 is enabled but the h2 package is not installed, using HTTP/1.1")
+        http2 = False
+    return MetricsTransport(httpx.AsyncHTTPTransport(
+        http2=http2,
+        proxy=proxy,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+    ))
+
+
+def environment_proxies() -> dict[str, str | None]:
+    """
+    環境変数のプロキシ設定をhttpxのmountsのパターンに変換する (httpxが環境変数から作る設定と同じ形式)。
+    NO_PROXYに含まれる宛先はNone (プロキシを経由しない) とする。
+    """
+    proxy_info = getproxies()
+    mounts = {}
+    for scheme in ("http", "https", "all"):
+        proxy = proxy_info.get(scheme)
+        if proxy:
+            mounts[f"{scheme}://"] = proxy if "://" in proxy else f"http://{proxy}"
+
+    for host in (host.strip() for host in proxy_info.get("no", "").split(",")):
+        if host == "*":
+            return {}
+        if not host:
+            continue
+        if "://" in host:
+            mounts[host] = None
+            continue
+        try:
+            address = ipaddress.ip_address(host)
+            mounts[f"all://[{host}]" if address.version == 6 else f"all://{host}"] = None
+        except ValueError:
+            # ドメイン名はサブドメインも対象とする
+            mounts["all://localhost" if host.lower() == "localhost" else f"all://*{host}"] = None
+    return mounts
+
+
+def build_proxy_mounts(**transport_options) -> dict[str, MetricsTransport | None]:
+    """
+    環境変数のプロキシ設定 (HTTPS_PROXY・ALL_PROXY・NO_PROXYなど) をhttpxのmountsに変換する。
+    transportを指定したクライアントは環境変数のプロキシを参照しないため、
+    プロキシ毎に同じ設定のトランスポートを作成する (Noneはプロキシを経由しない宛先)。
+    """
+    mounts = {}
+    for pattern, proxy in environment_proxies().items():
+        if proxy:
+            logger.info("Routing OpenAI requests for %s through proxy", pattern)
+            mounts[pattern] = build_openai_transport(**transport_options, proxy=proxy)
+        else:
+            mounts[pattern] = None
+    return mounts
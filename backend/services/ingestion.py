@@ -0,0 +1,391 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+import aiofiles
+import openai
+from services.file_index import file_index, sha256_digest
+from services.openai import VectorStoreIndexingError, client, get_assistant, upload_client
+from settings import env
+from utils.log import bind_log_context, logger, reset_log_context
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    RETRYING = "retrying"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+# 再起動時に再投入する未完了のステータス
+UNFINISHED_STATUSES = (JobStatus.QUEUED, JobStatus.RUNNING, JobStatus.RETRYING)
+
+# 再試行で回復する可能性があるOpenAI APIの例外
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, VectorStoreIndexingError):
+        return error.transient
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class IngestionJob:
+    def __init__(self, job_id, filename, size, vector_store_id, max_attempts, **state):
+        self.job_id = job_id
+        self.filename = filename
+        self.size = size
+        self.vector_store_id = vector_store_id
+        self.max_attempts = max_attempts
+        self.status = state.get("status", JobStatus.QUEUED)
+        self.attempts = state.get("attempts", 0)
+        self.file_id = state.get("file_id")
+        self.error = state.get("error")
+        self.created_at = state.get("created_at", time.time())
+        self.started_at = state.get("started_at")
+        self.finished_at = state.get("finished_at")
+        self.next_attempt_at = state.get("next_attempt_at")
+        self.sha256 = state.get("sha256")
+        # 同じ内容のファイルが既にアップロード済みで、既存のfile_idを再利用した場合にTrue
+        self.deduplicated = state.get("deduplicated", False)
+
+    def to_dict(self):
+        queue_wait = None
+        if self.started_at:
+            queue_wait = self.started_at - self.created_at
+        processing = None
+        if self.started_at and self.finished_at:
+            processing = self.finished_at - self.started_at
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "size": self.size,
+            "vector_store_id": self.vector_store_id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "file_id": self.file_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "next_attempt_at": self.next_attempt_at,
+            "sha256": self.sha256,
+            "deduplicated": self.deduplicated,
+            "timings": {
+                "queue_wait_seconds": queue_wait,
+                "processing_seconds": processing,
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data.pop("timings", None)
+        return cls(**data)
+
+
+class IngestionQueue:
+    """
+    Vector Storeへのファイル取り込みを行うプロセス内のジョブキュー。
+    ジョブの状態とファイル内容はディスクに保存し、再起動後も未完了のジョブを再開する。
+    """
+
+    def __init__(self, data_dir, workers, max_attempts, retry_base_seconds, history_size):
+        self.state_path = os.path.join(data_dir, "ingestion_jobs.json")
+        self.upload_dir = os.path.join(data_dir, "uploads")
+        self.worker_count = workers
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.history_size = history_size
+        self.jobs: dict[str, IngestionJob] = {}
+        self._queue = asyncio.Queue()
+        self._workers = []
+        self._retry_tasks = set()
+        self._save_lock = asyncio.Lock()
+
+    async def start(self):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        await self._load()
+        for job in self.jobs.values():
+            if job.status in UNFINISHED_STATUSES:
+                logger.info("Resuming ingestion job %s (%s)", job.job_id, job.filename)
+                job.status = JobStatus.QUEUED
+                self._queue.put_nowait(job.job_id)
+        self._workers = [
+            asyncio.create_task(self._worker(index)) for index in range(self.worker_count)
+        ]
+        logger.info("Ingestion queue started with %d workers", self.worker_count)
+
+    async def stop(self):
+        for task in [*self._workers, *self._retry_tasks]:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._retry_tasks, return_exceptions=True)
+        self._workers = []
+        await self._save()
+
+    async def enqueue(self, content: bytes, filename: str, vector_store_id: str) -> IngestionJob:
+        sha256 = await sha256_digest(content)
+
+        # 同じ内容を取り込み中のジョブがあればそれを返す
+        for pending in self.jobs.values():
+            if (pending.sha256 == sha256 and pending.vector_store_id == vector_store_id
+                    and pending.status in UNFINISHED_STATUSES):
+                logger.info("Ingestion job %s already handles %s", pending.job_id, filename)
+                return pending
+
+        job = IngestionJob(
+            job_id=uuid.uuid4().hex,
+            filename=filename,
+            size=len(content),
+            vector_store_id=vector_store_id,
+            max_attempts=self.max_attempts,
+            sha256=sha256,
+        )
+        self.jobs[job.job_id] = job
+
+        entry = await self._verified_entry(sha256, vector_store_id)
+        if entry:
+            job.file_id = entry["file_id"]
+            job.deduplicated = True
+            if vector_store_id in entry["vector_store_ids"]:
+                # アップロードもインデックス作成も不要
+                job.status = JobStatus.SUCCEEDED
+                job.finished_at = time.time()
+                await self._save()
+                logger.info("Skipped duplicate upload %s (file_id=%s)", filename, job.file_id)
+                return job
+
+        # 既存のファイルを再利用する場合も、失敗時に通常のアップロードに切り替えられるよう内容を保存する
+        async with aiofiles.open(self._content_path(job), "wb") as f:
+            await f.write(content)
+
+        await self._save()
+        self._queue.put_nowait(job.job_id)
+        logger.info("Ingestion job %s queued: %s (%d bytes)", job.job_id, filename, job.size)
+        return job
+
+    async def _verified_entry(self, sha256: str, vector_store_id: str) -> dict | None:
+        """
+        インデックスのエントリがOpenAI側にまだ存在するか確認する。
+        ファイルが削除済みの場合はエントリを除き、Vector Storeから外れている場合はその記録だけを除く。
+        """
+        entry = await file_index.lookup(sha256)
+        if not entry:
+            return None
+        file_id = entry["file_id"]
+        try:
+            await client.files.retrieve(file_id)
+        except openai.NotFoundError:
+            logger.info("Indexed file %s no longer exists, uploading again", file_id)
+            await file_index.remove_file(file_id)
+            return None
+        except Exception as e:
+            # 確認できない場合は再利用するが、Vector Storeへの追加は省略しない
+            logger.warning("Could not verify indexed file %s: %s", file_id, e)
+            return {**entry, "vector_store_ids": []}
+
+        if vector_store_id not in entry["vector_store_ids"]:
+            return entry
+        try:
+            vector_store_file = await client.beta.vector_stores.files.retrieve(
+                vector_store_id=vector_store_id,
+                file_id=file_id
+            )
+            if vector_store_file.status == "completed":
+                return entry
+        except openai.NotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Could not verify vector store file %s: %s", file_id, e)
+            return {**entry, "vector_store_ids": []}
+        logger.info("Indexed file %s is no longer in vector store %s", file_id, vector_store_id)
+        await file_index.remove_from_vector_store(file_id, vector_store_id)
+        return {**entry, "vector_store_ids": [v for v in entry["vector_store_ids"] if v != vector_store_id]}
+
+    def _content_path(self, job: IngestionJob) -> str:
+        return os.path.join(self.upload_dir, job.job_id)
+
+    def get(self, job_id: str) -> IngestionJob | None:
+        return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list[IngestionJob]:
+        return sorted(self.jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    async def _worker(self, index: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = self.jobs.get(job_id)
+                if job and job.status == JobStatus.QUEUED:
+                    log_token = bind_log_context(job_id=job_id)
+                    try:
+                        await self._process(job)
+                    finally:
+                        reset_log_context(log_token)
+            except Exception as e:
+                logger.error("Ingestion worker %s error: %s", index, e)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: IngestionJob):
+        job.status = JobStatus.RUNNING
+        job.attempts += 1
+        job.next_attempt_at = None
+        if job.started_at is None:
+            job.started_at = time.time()
+        await self._save()
+
+        try:
+            assistant = await get_assistant()
+            if job.file_id:
+                # アップロード済み (前回の試行または重複) の場合はVector Storeへの追加のみ行う
+                if job.attempts > 1:
+                    await self._detach_failed(job)
+                try:
+                    await assistant.attach_file_to_vector_store(job.file_id, job.vector_store_id)
+                except openai.NotFoundError:
+                    if not job.deduplicated:
+                        raise
+                    # 再利用したファイルがOpenAI側で削除されていた場合は、保存した内容からアップロードし直す
+                    logger.info("Reused file %s no longer exists, uploading again", job.file_id)
+                    await file_index.remove_file(job.file_id)
+                    job.file_id = None
+                    job.deduplicated = False
+            if not job.file_id:
+                async with aiofiles.open(self._content_path(job), "rb") as f:
+                    content = await f.read()
+                job.file_id = (await upload_client.files.create(
+                    file=(job.filename, content),
+                    purpose="assistants"
+                )).id
+                await assistant.attach_file_to_vector_store(job.file_id, job.vector_store_id)
+        except Exception as e:
+            transient = _is_transient(e)
+            job.error = {
+                "type": type(e).__name__,
+                "message": str(e),
+                "transient": transient,
+                "attempt": job.attempts,
+            }
+            if transient and job.attempts < job.max_attempts:
+                delay = self.retry_base_seconds * (2 ** (job.attempts - 1))
+                job.status = JobStatus.RETRYING
+                job.next_attempt_at = time.time() + delay
+                logger.warning("Ingestion job %s failed (attempt %d), retrying in %.1fs: %s",
+                               job.job_id, job.attempts, delay, e)
+                self._schedule_retry(job.job_id, delay)
+            else:
+                job.status = JobStatus.FAILED
+                job.finished_at = time.time()
+                logger.error("Ingestion job %s failed: %s", job.job_id, e)
+                await self._discard_upload(job)
+                await self._remove_content(job)
+            await self._save()
+            return
+
+        job.status = JobStatus.SUCCEEDED
+        job.error = None
+        job.finished_at = time.time()
+        if job.sha256:
+            await file_index.record(job.sha256, job.file_id, job.filename,
+                                    vector_store_id=job.vector_store_id)
+        logger.info("Ingestion job %s succeeded: %s -> %s", job.job_id, job.filename, job.file_id)
+        await self._remove_content(job)
+        await self._save()
+
+    async def _detach_failed(self, job: IngestionJob):
+        try:
+            await client.beta.vector_stores.files.delete(
+                vector_store_id=job.vector_store_id,
+                file_id=job.file_id
+            )
+        except Exception:
+            pass
+
+    async def _discard_upload(self, job: IngestionJob):
+        """
+        このジョブでアップロードしたファイルの追加に失敗した場合、どこからも参照されない
+        OpenAIのファイルが残らないよう削除する (重複として再利用したファイルは削除しない)
+        """
+        if not job.file_id or job.deduplicated:
+            return
+        await self._detach_failed(job)
+        try:
+            await client.files.delete(job.file_id)
+            logger.info("Deleted orphaned file %s of failed job %s", job.file_id, job.job_id)
+            job.file_id = None
+        except openai.NotFoundError:
+            job.file_id = None
+        except Exception as e:
+            logger.warning("Failed to delete orphaned file %s: %s", job.file_id, e)
+
+    def _schedule_retry(self, job_id: str, delay: float):
+        async def requeue():
+            await asyncio.sleep(delay)
+            job = self.jobs.get(job_id)
+            if job and job.status == JobStatus.RETRYING:
+                job.status = JobStatus.QUEUED
+                self._queue.put_nowait(job_id)
+
+        task = asyncio.create_task(requeue())
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _remove_content(self, job: IngestionJob):
+        try:
+            await asyncio.to_thread(os.remove, self._content_path(job))
+        except FileNotFoundError:
+            pass
+
+    def _prune_history(self):
+        finished = [
+            job for job in self.jobs.values()
+            if job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+        ]
+        excess = len(finished) - self.history_size
+        if excess > 0:
+            for job in sorted(finished, key=lambda job: job.finished_at or 0)[:excess]:
+                del self.jobs[job.job_id]
+
+    async def _load(self):
+        try:
+            async with aiofiles.open(self.state_path, "r", encoding="utf-8") as f:
+                data = json.loads(await f.read())
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error("Failed to load ingestion jobs: %s", e)
+            return
+        for item in data.get("jobs", []):
+            job = IngestionJob.from_dict(item)
+            self.jobs[job.job_id] = job
+
+    async def _save(self):
+        async with self._save_lock:
+            self._prune_history()
+            data = json.dumps(
+                {"jobs": [job.to_dict() for job in self.jobs.values()]},
+                ensure_ascii=False
+            )
+            # 書き込み途中で停止しても壊れないよう一時ファイルから置き換える
+            temp_path = f"{self.state_path}.tmp"
+            async with aiofiles.open(temp_path, "w", encoding="utf-8") as f:
+                await f.write(data)
+            await asyncio.to_thread(os.replace, temp_path, self.state_path)
+
+
+ingestion_queue = IngestionQueue(
+    data_dir=env.DATA_DIR,
+    workers=env.INGESTION_WORKERS,
+    max_attempts=env.INGESTION_MAX_ATTEMPTS,
+    retry_base_seconds=env.INGESTION_RETRY_BASE_SECONDS,
+    history_size=env.INGESTION_JOB_HISTORY,
+)
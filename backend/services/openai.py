@@ -1,10 +1,20 @@
 import asyncio
 import json
-import requests
-from requests.exceptions import RequestException
-from openai import AsyncOpenAI
+from functools import partial
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from services import aiko
+from services.http_transport import (
+    build_openai_transport,
+    build_proxy_mounts,
+    collect_pool_metrics,
+    combined_pool_stats,
+)
+from services.vector_store_catalog import VectorStoreCatalog
 from settings import const, env
-from utils.log import logger
+from utils.log import bind_log_context, log_payload, logger, reset_log_context
+from utils.metrics import CHAT_POLL_ITERATIONS, registry
+from utils.tracing import annotate_trace, trace_stage
 
 # グローバル定数の定義
 DXA_FUNCTION_DESC = {
@@ -39,7 +49,51 @@ TOOLS = [
     {"type": "file_search"},
 ]
 
-client = AsyncOpenAI(api_key=env.API_KEY)
+# 接続プールを設定し、操作毎のレイテンシを記録するトランスポートを使用する
+_transport_options = dict(
+    max_connections=env.OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=env.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=env.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+    http2=env.OPENAI_HTTP2,
+)
+openai_transport = build_openai_transport(**_transport_options)
+# 環境変数で指定されたプロキシ経由の宛先 (プロキシを使わない場合は空)
+openai_proxy_mounts = build_proxy_mounts(**_transport_options)
+_pool_transports = [openai_transport, *(transport for transport in openai_proxy_mounts.values() if transport)]
+registry.add_collector(partial(collect_pool_metrics, _pool_transports))
+
+
+def _timeout(seconds: float) -> httpx.Timeout:
+    return httpx.Timeout(
+        seconds,
+        connect=env.OPENAI_CONNECT_TIMEOUT_SECONDS,
+        pool=env.OPENAI_POOL_TIMEOUT_SECONDS,
+    )
+
+
+client = AsyncOpenAI(
+    api_key=env.API_KEY,
+    base_url=env.OPENAI_BASE_URL,
+    timeout=_timeout(env.OPENAI_TIMEOUT_SECONDS),
+    max_retries=env.OPENAI_MAX_RETRIES,
+    http_client=DefaultAsyncHttpxClient(transport=openai_transport, mounts=openai_proxy_mounts)
+)
+# 操作の種類毎のタイムアウトを設定したクライアント (接続プールは共有する)
+polling_client = client.with_options(timeout=_timeout(env.OPENAI_POLL_TIMEOUT_SECONDS))
+upload_client = client.with_options(timeout=_timeout(env.OPENAI_UPLOAD_TIMEOUT_SECONDS))
+download_client = client.with_options(timeout=_timeout(env.OPENAI_DOWNLOAD_TIMEOUT_SECONDS))
+
+
+def get_pool_stats() -> dict:
+    # プロキシを経由するリクエストの接続プールも合計する
+    stats = combined_pool_stats(_pool_transports)
+    proxied = sorted(pattern for pattern, transport in openai_proxy_mounts.items() if transport)
+    if proxied:
+        stats["proxied"] = proxied
+    return stats
+
+
+vector_store_catalog = VectorStoreCatalog(client, refresh_interval=env.VECTOR_STORE_REFRESH_SECONDS)
 
 # グローバルなアシスタントインスタンスを作成, key: model, value: Assistant
 assistant_dict = {}
@@ -53,33 +107,83 @@ async def get_assistant(model: str = const.DEFAULT_MODEL_NAME):
     return assistant
 
 
-def _generate_aiko_message(query):
-    # TODO 一旦固定で作成済みのconversation_idを使用
-    # conversation_id毎に会話履歴を保持しているのでチャンネル毎に作成した方が良い
-    conversation_id = env.AIKO_CONVERSATION_ID
-    url = f'{env.AIKO_API_DOMAIN}/conversations/{conversation_id}/messages/sync'
-    body = json.dumps({ "message": query, "language_code": "ja" })
+async def _generate_aiko_message(query, session_key: str | None = None):
+    # conversation_idはaikoモジュールの会話プールからセッション (スレッド) 毎に貸し出される
+    # 遅延時のヘッジリクエストと障害時のサーキットブレーカーもaikoモジュールで処理する
+    return await aiko.send_message(query, session_key)
 
-    response = requests.post(
-        url,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {env.AIKO_API_KEY}"
-        },
-        data=body
-    )
+
+async def call_dxa_factory(question: str, session_key: str | None = None) -> dict:
+    return await _generate_aiko_message(question, session_key)
+
+
+def _project_task_result(task_result):
+    if not isinstance(task_result, dict):
+        return task_result
+    return {
+        "content": task_result.get("content"),
+        "citations": [
+            {
+                "source": citation.get("source"),
+                "file_path": citation.get("file_path"),
+                "page_index": citation.get("page_index"),
+                "type": citation.get("type"),
+                "image_src": citation.get("image_src"),
+            }
+            for citation in task_result.get("citations") or []
+        ],
+    }
+
+
+def project_dxa_response(dxa_response):
+    """
+    DXAレスポンスからUIで表示する項目 (task_resultと出典) のみを抽出する。
+    想定外の形式の場合はそのまま返す。
+    """
     try:
-        response.raise_for_status()
-    except RequestException as e:
-        logger.error(f"request failed. error=({e.response.text})")
-        return f"request failed. status: {response.status_code}"
-    data = response.json()
-    logger.info(data)
-    return data
+        answer = dxa_response["answer"]
+        response = answer["response"]
+    except (KeyError, TypeError):
+        return dxa_response
+
+    return {
+        "status": dxa_response.get("status"),
+        "answer": {
+            "success": answer.get("success"),
+            "task_id": answer.get("task_id"),
+            "response": {
+                "main_task": response.get("main_task"),
+                "ooda_task_id": response.get("ooda_task_id"),
+                "task_result": _project_task_result(response.get("task_result")),
+                "substasks": [
+                    {
+                        "status": task.get("status"),
+                        "task": task.get("task"),
+                        "task_id": task.get("task_id"),
+                        "task_result": _project_task_result(task.get("task_result")),
+                    }
+                    for task in response.get("substasks") or []
+                ],
+            },
+        },
+    }
+
 
+class VectorStoreIndexingError(Exception):
+    """Vector Storeへのファイル追加 (インデックス作成) が完了しなかった場合のエラー"""
 
-def call_dxa_factory(question: str) -> str:
-    return _generate_aiko_message(question)
+    # 再試行で回復する可能性があるエラーコード
+    TRANSIENT_CODES = ("server_error", "rate_limit_exceeded")
+
+    def __init__(self, file_id, status, code=None, message=None):
+        super().__init__(f"Indexing {file_id} ended with status {status}: {code} {message}")
+        self.file_id = file_id
+        self.status = status
+        self.code = code
+
+    @property
+    def transient(self):
+        return self.code in self.TRANSIENT_CODES
 
 
 class Assistant:
@@ -103,17 +207,18 @@ class Assistant:
             # 1. まず最初にベクターストアの確認と設定
             if self.model in const.FILE_SEARCH_MODELS and not self.vector_store_id:
                 logger.debug("Checking existing vector stores...")
-                vector_stores = await client.beta.vector_stores.list()
-                if vector_stores.data:
+                vector_stores = await vector_store_catalog.list_stores()
+                if vector_stores:
                     # 既存のベクターストアを使用
-                    self.vector_store_id = vector_stores.data[0].id
-                    logger.info(f"Reusing existing vector store: {self.vector_store_id}")
+                    self.vector_store_id = vector_stores[0]["id"]
+                    logger.info("Reusing existing vector store: %s", self.vector_store_id)
                 else:
                     # ベクターストアが存在しない場合のみ新規作成
                     logger.debug("No existing vector store found. Creating new vector store...")
                     vector_store = await client.beta.vector_stores.create()
+                    vector_store_catalog.add(vector_store)
                     self.vector_store_id = vector_store.id
-                    logger.info(f"New vector store created with ID: {self.vector_store_id}")
+                    logger.info("New vector store created with ID: %s", self.vector_store_id)
 
             # 2. アシスタントの設定
             if not self.assistant_id:
@@ -124,9 +229,9 @@ class Assistant:
                         # 環境変数のアシスタントIDが有効か確認
                         existing_assistant = await client.beta.assistants.retrieve(env_assistant_id)
                         self.assistant_id = existing_assistant.id
-                        logger.info(f"Using assistant from environment variable: {self.assistant_id}")
+                        logger.info("Using assistant from environment variable: %s", self.assistant_id)
                     except Exception as e:
-                        logger.warning(f"Failed to retrieve assistant from environment variable: {str(e)}")
+                        logger.warning("Failed to retrieve assistant from environment variable: %s", e)
                         self.assistant_id = None
 
             # アシスタントIDがない場合は新規作成
@@ -148,17 +253,17 @@ class Assistant:
                         tools=[{"type": "function", "function": DXA_FUNCTION_DESC}],
                     )
                 self.assistant_id = new_assistant.id
-                logger.info(f"Created new assistant with ID: {self.assistant_id}")
+                logger.info("Created new assistant with ID: %s", self.assistant_id)
 
             # 3. 会話スレッドの作成
             if not self.conversation_thread:
                 logger.debug("Creating thread...")
                 thread = await client.beta.threads.create()
                 self.conversation_thread = thread.id
-                logger.info(f"Thread created with ID: {self.conversation_thread}")
+                logger.info("Thread created with ID: %s", self.conversation_thread)
 
         except Exception as e:
-            logger.error(f"Error during initialization: {str(e)}", exc_info=True)
+            logger.error("Error during initialization: %s", e, exc_info=True)
             raise
 
     async def get_response(self, message: str):
@@ -203,15 +308,17 @@ class Assistant:
             }
 
         except Exception as e:
-            logger.error(f"Error in get_response: {str(e)}", exc_info=True)
+            logger.error("Error in get_response: %s", e, exc_info=True)
             raise
 
     async def poll_run(self, run_id, thread_id):
         while True:
-            run = await client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run_id
-            )
+            with trace_stage("poll", aggregate=True):
+                run = await polling_client.beta.threads.runs.retrieve(
+                    thread_id=thread_id,
+                    run_id=run_id
+                )
+            CHAT_POLL_ITERATIONS.labels(model=self.model).inc()
             logger.info("run status: %s", run.status)
             if run.status in ['completed', 'requires_action']:
                 return run
@@ -220,6 +327,13 @@ class Assistant:
             await asyncio.sleep(0.5)
 
     async def generate_message(self, run_id, thread_id):
+        log_token = bind_log_context(thread_id=thread_id, run_id=run_id)
+        try:
+            return await self._generate_message(run_id, thread_id)
+        finally:
+            reset_log_context(log_token)
+
+    async def _generate_message(self, run_id, thread_id):
         while True:
             try:
                 run = await self.poll_run(run_id, thread_id)
@@ -237,7 +351,7 @@ class Assistant:
 
                 # Loop through each tool in the required action section
                 if run.status == 'requires_action' and run.required_action:
-                    logger.info(f"Required action details: {json.dumps(run.required_action.model_dump(), indent=2)}")
+                    log_payload("Required action details", run.required_action)
                     tool_outputs = []
 
                     if not hasattr(run.required_action, 'submit_tool_outputs') or not run.required_action.submit_tool_outputs:
@@ -257,7 +371,7 @@ class Assistant:
                         return run
 
                     for tool in run.required_action.submit_tool_outputs.tool_calls:
-                        logger.info(f"Processing tool call: {json.dumps(tool.model_dump(), indent=2)}")
+                        log_payload("Processing tool call", tool)
 
                         if tool.type != "function":
                             logger.info("no function tool: %s", tool)
@@ -267,7 +381,9 @@ class Assistant:
                             try:
                                 arg = json.loads(tool.function.arguments)
                                 logger.info("Processing securities report question: %s", arg['question'])
-                                answer = call_dxa_factory(arg['question'])['answer']['response']['task_result']['content']
+                                with trace_stage("dxa_call"):
+                                    dxa_response = await call_dxa_factory(arg['question'], thread_id)
+                                answer = dxa_response['answer']['response']['task_result']['content']
                                 if not answer:
                                     logger.warning("No answer found in securities report")
                                     answer = "申し訳ありません。該当する決算情報が見つかりませんでした。"
@@ -286,12 +402,13 @@ class Assistant:
                     # Submit tool outputs if any exist
                     if tool_outputs:
                         try:
-                            logger.info(f"Submitting tool outputs: {json.dumps(tool_outputs, indent=2)}")
-                            await client.beta.threads.runs.submit_tool_outputs(
-                                thread_id=thread_id,
-                                run_id=run_id,
-                                tool_outputs=tool_outputs
-                            )
+                            log_payload("Submitting tool outputs", tool_outputs)
+                            with trace_stage("submit_tool_outputs"):
+                                await client.beta.threads.runs.submit_tool_outputs(
+                                    thread_id=thread_id,
+                                    run_id=run_id,
+                                    tool_outputs=tool_outputs
+                                )
                             logger.info("Tool outputs submitted successfully.")
                         except Exception as e:
                             logger.error("Failed to submit tool outputs: %s", e)
@@ -311,7 +428,7 @@ class Assistant:
                         return run
 
             except Exception as e:
-                logger.error(f"Error in generate_message: {str(e)}")
+                logger.error("Error in generate_message: %s", e)
                 # エラーが発生した場合は実行をキャンセル
                 try:
                     await client.beta.threads.runs.cancel(
@@ -319,9 +436,49 @@ class Assistant:
                         run_id=run_id
                     )
                 except Exception as cancel_error:
-                    logger.error(f"Error cancelling run: {str(cancel_error)}")
+                    logger.error("Error cancelling run: %s", cancel_error)
                 raise
 
+    async def answer_question(self, question: str) -> dict:
+        """
+        新しいスレッドで1件の質問に回答する (バッチ処理用)。
+        call_dxa_factoryのツール呼び出しはgenerate_messageで処理する。
+        """
+        with trace_stage("runs_create"):
+            run = await client.beta.threads.create_and_run(
+                assistant_id=self.assistant_id,
+                model=self.model,
+                thread={"messages": [{"role": "user", "content": question}]},
+                tool_choice="auto"
+            )
+        annotate_trace(thread_id=run.thread_id, run_id=run.id)
+        run = await self.generate_message(run.id, run.thread_id)
+        if run.status != "completed":
+            raise Exception(f"Run did not complete: {run.status}")
+
+        with trace_stage("messages_list"):
+            messages = await client.beta.threads.messages.list(
+                thread_id=run.thread_id,
+                order="desc",
+                limit=1
+            )
+        assistant_message = next((msg for msg in messages.data if msg.role == "assistant"), None)
+        text = "".join(
+            part.text.value for part in (assistant_message.content if assistant_message else [])
+            if part.type == "text"
+        )
+        usage = run.usage
+        return {
+            "thread_id": run.thread_id,
+            "run_id": run.id,
+            "text": text,
+            "token_usage": {
+                "prompt_tokens": usage.prompt_tokens if usage else 0,
+                "completion_tokens": usage.completion_tokens if usage else 0,
+                "total_tokens": usage.total_tokens if usage else 0
+            }
+        }
+
     async def upload_file_to_vector_store(self, content, filename):
         try:
             # ファイルをVector Storeにアップロード
@@ -329,7 +486,24 @@ class Assistant:
                 vector_store_id=self.vector_store_id,
                 files=[(filename, content)]
             )
-            logger.info(f"File uploaded to vector store: {filename}")
+            logger.info("File uploaded to vector store: %s", filename)
         except Exception as e:
-            logger.error(f"Error uploading file to vector store: {str(e)}")
+            logger.error("Error uploading file to vector store: %s", e)
             raise
+
+    async def attach_file_to_vector_store(self, file_id, vector_store_id=None):
+        """アップロード済みのファイルをVector Storeに追加し、インデックスに失敗した場合は例外を送出する"""
+        # インデックス完了までのポーリングはポーリング用のタイムアウトで行う
+        vector_store_file = await polling_client.beta.vector_stores.files.create_and_poll(
+            vector_store_id=vector_store_id or self.vector_store_id,
+            file_id=file_id
+        )
+        if vector_store_file.status != "completed":
+            last_error = vector_store_file.last_error
+            raise VectorStoreIndexingError(
+                file_id=file_id,
+                status=vector_store_file.status,
+                code=last_error.code if last_error else None,
+                message=last_error.message if last_error else None,
+            )
+        return vector_store_file
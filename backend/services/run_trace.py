@@ -0,0 +1,193 @@
+import asyncio
+import json
+import math
+import os
+from typing import Callable, Iterator
+import aiofiles
+from services.openai import client
+from settings import env
+from utils.log import logger
+from utils.tracing import RunTrace
+
+# トレースのファイルを末尾から読む際のブロックサイズ
+_READ_BLOCK_BYTES = 64 * 1024
+
+
+async def fetch_step_spans(trace: RunTrace) -> list[dict]:
+    """
+    runs.steps.list のRun Stepをspanに変換する。
+    ステップの時刻は秒単位のため、開始・所要時間の精度も1秒程度となる。
+    """
+    spans = []
+    async for step in client.beta.threads.runs.steps.list(
+        thread_id=trace.thread_id,
+        run_id=trace.run_id,
+        order="asc",
+        limit=100
+    ):
+        ended_at = step.completed_at or step.failed_at or step.cancelled_at or step.expired_at
+        name = f"step.{step.type}"
+        tools = []
+        if step.type == "tool_calls":
+            tools = sorted({tool_call.type for tool_call in step.step_details.tool_calls})
+            name = f"{name}:{'+'.join(tools)}"
+        spans.append({
+            "name": name,
+            "start": round(step.created_at - trace.started_at, 4),
+            "duration": (ended_at - step.created_at) if ended_at else None,
+            "status": step.status,
+            "step_id": step.id,
+            "tools": tools,
+            "usage": step.usage.model_dump() if step.usage else None,
+        })
+    return spans
+
+
+def _parse(line: bytes) -> dict | None:
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        # 書き込み途中で停止した行は読み飛ばす
+        return None
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class RunTraceStore:
+    """Runのトレースを追記専用のJSONLファイルに保存し、検索・集計する"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = asyncio.Lock()
+        # 保存が終わるまでタスクへの参照を保持する
+        self._pending = set()
+
+    def record(self, trace: RunTrace):
+        """Run Stepの取得と保存をバックグラウンドで行う (レスポンスを遅らせない)"""
+        if not trace.run_id:
+            return
+        task = asyncio.create_task(self._record(trace))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _record(self, trace: RunTrace):
+        record = trace.to_dict()
+        try:
+            record["spans"] = [*record["spans"], *await fetch_step_spans(trace)]
+        except Exception as e:
+            logger.warning("Failed to fetch run steps for %s: %s", trace.run_id, e)
+        record["spans"].sort(key=lambda span: span["start"])
+        try:
+            await self.append(record)
+        except Exception as e:
+            logger.error("Error saving run trace: %s", e)
+
+    async def append(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        async with self._lock:
+            await asyncio.to_thread(self._prepare_append, len(line.encode("utf-8")))
+            async with aiofiles.open(self.path, "a", encoding="utf-8") as f:
+                await f.write(line)
+
+    def _prepare_append(self, size: int):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # 上限を超えたら1世代だけ残してローテーションする
+        if os.path.exists(self.path) and os.path.getsize(self.path) + size > self.max_bytes:
+            os.replace(self.path, f"{self.path}.1")
+
+    def _iter_newest(self) -> Iterator[dict]:
+        """新しい順にレコードを返す。ファイルを末尾からブロック単位で読み、必要な分だけ解析する"""
+        for path in (self.path, f"{self.path}.1"):
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                position = f.seek(0, os.SEEK_END)
+                remainder = b""
+                while position > 0:
+                    size = min(_READ_BLOCK_BYTES, position)
+                    position -= size
+                    f.seek(position)
+                    lines = (f.read(size) + remainder).split(b"\n")
+                    # 先頭の行はブロックの境界で途切れている可能性があるため次のブロックと結合する
+                    remainder = lines.pop(0)
+                    for line in reversed(lines):
+                        record = _parse(line)
+                        if record is not None:
+                            yield record
+                record = _parse(remainder)
+                if record is not None:
+                    yield record
+
+    def _read_newest(self, limit: int, match: Callable[[dict], bool]) -> list[dict]:
+        records = []
+        for record in self._iter_newest():
+            if match(record):
+                records.append(record)
+                if len(records) >= limit:
+                    break
+        return records
+
+    async def query(self, thread_id: str | None = None, run_id: str | None = None, limit: int = 50) -> list[dict]:
+        """条件に一致するトレースを新しい順に返す"""
+        return await asyncio.to_thread(
+            self._read_newest,
+            limit,
+            lambda record: (not thread_id or record["thread_id"] == thread_id)
+            and (not run_id or record["run_id"] == run_id),
+        )
+
+    async def summary(self, limit: int = 1000, source: str | None = None) -> dict:
+        """
+        直近のRunについて、span毎の所要時間の合計・平均・p50/p95と
+        Runの経過時間に占める割合を集計する (spanは重なり得るため割合の合計は100%にならない)
+        """
+        records = await asyncio.to_thread(
+            self._read_newest,
+            limit,
+            lambda record: not source or record["source"] == source,
+        )
+
+        wall = [record["wall_seconds"] for record in records if record.get("wall_seconds")]
+        total_wall = sum(wall)
+        durations: dict[str, list[float]] = {}
+        for record in records:
+            for span in record["spans"]:
+                if span.get("duration") is not None:
+                    durations.setdefault(span["name"], []).append(span["duration"])
+            for name, aggregate in record.get("aggregates", {}).items():
+                durations.setdefault(name, []).append(aggregate["seconds"])
+
+        spans = {
+            name: {
+                "count": len(values),
+                "total_seconds": round(sum(values), 3),
+                "mean_seconds": round(sum(values) / len(values), 3),
+                "p50_seconds": _percentile(values, 0.50),
+                "p95_seconds": _percentile(values, 0.95),
+                "share_of_wall": round(sum(values) / total_wall, 4) if total_wall else None,
+            }
+            for name, values in sorted(durations.items(), key=lambda item: -sum(item[1]))
+        }
+        return {
+            "runs": len(records),
+            "wall_seconds": {
+                "total": round(total_wall, 3),
+                "p50": _percentile(wall, 0.50),
+                "p95": _percentile(wall, 0.95),
+            },
+            "spans": spans,
+        }
+
+
+run_trace_store = RunTraceStore(
+    path=os.path.join(env.DATA_DIR, "run_traces.jsonl"),
+    max_bytes=env.RUN_TRACE_MAX_BYTES,
+)
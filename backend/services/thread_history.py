@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from services.openai import client
+from settings import env
+
+
+def _message_view(message) -> dict:
+    """OpenAIのメッセージを画面表示に必要な項目だけに変換する"""
+    text = []
+    images = []
+    files = []
+    for part in message.content:
+        if part.type == "text":
+            text.append(part.text.value)
+            for annotation in part.text.annotations or []:
+                file_path = getattr(annotation, "file_path", None)
+                if file_path:
+                    files.append(file_path.file_id)
+        elif part.type == "image_file":
+            images.append(part.image_file.file_id)
+    return {
+        "id": message.id,
+        "role": message.role,
+        "created_at": message.created_at,
+        "run_id": message.run_id,
+        "text": "".join(text),
+        "image_file_ids": images,
+        "file_ids": files,
+    }
+
+
+class ThreadHistoryCache:
+    """
+    スレッドのメッセージ一覧をページ単位でキャッシュする。
+    スレッドでRunが完了した時にinvalidateで破棄し、
+    それ以外の経路での更新に備えてTTLでも失効させる。
+    """
+
+    def __init__(self, max_pages: int, ttl_seconds: float):
+        self.max_pages = max_pages
+        self.ttl = ttl_seconds
+        self._pages: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+        # 同じページへの同時リクエストは1回の取得にまとめる
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._versions: dict[str, int] = {}
+
+    async def get_page(self, thread_id: str, limit: int, order: str, after: str | None) -> dict:
+        key = (thread_id, limit, order, after)
+        cached = self._pages.get(key)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            self._pages.move_to_end(key)
+            return cached[1]
+
+        inflight = self._inflight.get(key)
+        if inflight:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # 取得していたリクエストがキャンセルされた場合は、自分で取得し直す
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await self.get_page(thread_id, limit, order, after)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        version = self._versions.get(thread_id, 0)
+        try:
+            page = await self._fetch(thread_id, limit, order, after)
+        except Exception as e:
+            future.set_exception(e)
+            # 待機者がいない場合に未取得の例外として警告されないようにする
+            future.exception()
+            raise
+        else:
+            future.set_result(page)
+            # 取得中にinvalidateされた場合は古い内容をキャッシュしない
+            if self._versions.get(thread_id, 0) == version:
+                self._pages[key] = (time.monotonic(), page)
+                while len(self._pages) > self.max_pages:
+                    self._pages.popitem(last=False)
+            return page
+        finally:
+            self._inflight.pop(key, None)
+            # 取得がキャンセルされた場合は、待機中の他のリクエストも終了させる
+            if not future.done():
+                future.cancel()
+
+    def invalidate(self, thread_id: str):
+        self._versions[thread_id] = self._versions.get(thread_id, 0) + 1
+        for key in [key for key in self._pages if key[0] == thread_id]:
+            del self._pages[key]
+
+    async def _fetch(self, thread_id: str, limit: int, order: str, after: str | None) -> dict:
+        params = {"thread_id": thread_id, "limit": limit, "order": order}
+        if after:
+            params["after"] = after
+        result = await client.beta.threads.messages.list(**params)
+        messages = [_message_view(message) for message in result.data]
+        page = {
+            "thread_id": thread_id,
+            "messages": messages,
+            "has_more": result.has_more,
+            # 次のページの取得に使うカーソル (afterに指定する)
+            "next_cursor": messages[-1]["id"] if result.has_more and messages else None,
+        }
+        digest = hashlib.sha256(
+            json.dumps(page, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        page["etag"] = f'W/"{digest[:32]}"'
+        return page
+
+
+thread_history = ThreadHistoryCache(
+    max_pages=env.THREAD_HISTORY_CACHE_PAGES,
+    ttl_seconds=env.THREAD_HISTORY_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from datetime import datetime
+from utils.log import logger
+
+
+def _store_view(store) -> dict:
+    return {
+        "id": store.id,
+        "name": store.name,
+        "created_at": store.created_at,
+        "status": store.status,
+        "usage_bytes": store.usage_bytes,
+        "file_counts": store.file_counts.model_dump() if store.file_counts else None,
+    }
+
+
+class VectorStoreCatalog:
+    """
+    Vector Storeの一覧を全ページ取得してメモリに保持し、一定間隔でバックグラウンド更新する。
+    APIの一覧 (/api/vector-stores, /api/system-info) とアシスタントの初期化はここから参照する。
+    """
+
+    def __init__(self, client, refresh_interval: float):
+        self.client = client
+        self.refresh_interval = refresh_interval
+        # OpenAIの一覧と同じく作成日時の新しい順
+        self.stores: list[dict] = []
+        self.refreshed_at: float | None = None
+        self.last_error: str | None = None
+        self._refresh_lock = asyncio.Lock()
+        self._task = None
+
+    async def refresh(self) -> list[dict]:
+        # 同時に要求された更新は1回の取得にまとめる
+        started = time.time()
+        async with self._refresh_lock:
+            if self.refreshed_at and self.refreshed_at >= started:
+                return self.stores
+            try:
+                stores = [_store_view(store) async for store in self.client.beta.vector_stores.list(limit=100)]
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            self.stores = stores
+            self.refreshed_at = time.time()
+            self.last_error = None
+            logger.debug("Vector store catalog refreshed (%d stores)", len(stores))
+            return stores
+
+    async def list_stores(self) -> list[dict]:
+        """一覧を返す。まだ取得していない場合のみAPIを呼び出す"""
+        if self.refreshed_at is None:
+            await self.refresh()
+        return self.stores
+
+    def get(self, vector_store_id: str) -> dict | None:
+        return next((store for store in self.stores if store["id"] == vector_store_id), None)
+
+    def add(self, store):
+        """作成したVector Storeを次回の更新を待たずに一覧へ反映する"""
+        self.stores = [_store_view(store), *[s for s in self.stores if s["id"] != store.id]]
+
+    def status(self) -> dict:
+        age = time.time() - self.refreshed_at if self.refreshed_at else None
+        return {
+            "refreshed_at": datetime.fromtimestamp(self.refreshed_at).isoformat() if self.refreshed_at else None,
+            "age_seconds": round(age, 1) if age is not None else None,
+            # 更新が2回分以上遅れている、または最後の更新に失敗している
+            "stale": age is None or age > self.refresh_interval * 2 or self.last_error is not None,
+            "last_error": self.last_error,
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                # 取得に失敗した場合は前回の一覧を使い続ける
+                logger.warning("Failed to refresh vector store catalog: %s", e)
@@ -1,2 +1,6 @@
 DEFAULT_MODEL_NAME = "gpt-4o"
 FILE_SEARCH_MODELS = ["gpt-4o"]
+
+# DXAイベントの送信形式
+DXA_PAYLOAD_COMPACT = "compact"  # UIで表示する項目のみ
+DXA_PAYLOAD_FULL = "full"        # AIKOのレスポンスをそのまま送信
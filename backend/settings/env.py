@@ -7,7 +7,93 @@ API_KEY = os.getenv("OPENAI_API_KEY")
 if not API_KEY:
     raise ValueError("OPENAI_API_KEY is not set in environment variables")
 
+# 負荷試験ではスタブサーバー (benchmarks/fake_backend.py) を指定する
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# OpenAIクライアントの接続プールとタイムアウト (秒)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "30"))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "false").lower() == "true"  # h2パッケージが必要
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_POOL_TIMEOUT_SECONDS = float(os.getenv("OPENAI_POOL_TIMEOUT_SECONDS", "10"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_POLL_TIMEOUT_SECONDS = float(os.getenv("OPENAI_POLL_TIMEOUT_SECONDS", "15"))
+OPENAI_UPLOAD_TIMEOUT_SECONDS = float(os.getenv("OPENAI_UPLOAD_TIMEOUT_SECONDS", "300"))
+OPENAI_DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("OPENAI_DOWNLOAD_TIMEOUT_SECONDS", "120"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
 ASSISTANT_ID = os.getenv("ASSISTANT_ID")
 AIKO_API_DOMAIN = os.getenv("AIKO_API_DOMAIN")
 AIKO_API_KEY = os.getenv("AIKO_API_KEY")
 AIKO_CONVERSATION_ID = os.getenv("AIKO_CONVERSATION_ID")
+
+# 実行時の状態 (ジョブ、インデックスなど) を保存するディレクトリ
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+
+# チャットイベントストリーム (再接続時の再送用バッファ)
+EVENT_STREAM_BUFFER_SIZE = int(os.getenv("EVENT_STREAM_BUFFER_SIZE", "1000"))
+EVENT_STREAM_RETENTION_SECONDS = float(os.getenv("EVENT_STREAM_RETENTION_SECONDS", "600"))
+
+# チャットイベントのワイヤーフォーマット
+DXA_EVENT_PAYLOAD = os.getenv("DXA_EVENT_PAYLOAD", "compact")
+STREAM_COMPRESSION_ENABLED = os.getenv("STREAM_COMPRESSION_ENABLED", "true").lower() == "true"
+STREAM_COMPRESSION_LEVEL = int(os.getenv("STREAM_COMPRESSION_LEVEL", "6"))
+
+# DXA (AIKO) 呼び出しのヘッジとサーキットブレーカー
+AIKO_TIMEOUT_SECONDS = float(os.getenv("AIKO_TIMEOUT_SECONDS", "120"))
+DXA_HEDGING_ENABLED = os.getenv("DXA_HEDGING_ENABLED", "true").lower() == "true"
+DXA_HEDGE_PERCENTILE = float(os.getenv("DXA_HEDGE_PERCENTILE", "0.95"))
+DXA_HEDGE_MIN_SAMPLES = int(os.getenv("DXA_HEDGE_MIN_SAMPLES", "20"))
+# 直近のリクエストのうちヘッジを送信してよい割合 (DXA障害時に負荷が倍増するのを防ぐ)
+DXA_HEDGE_BUDGET_RATIO = float(os.getenv("DXA_HEDGE_BUDGET_RATIO", "0.1"))
+DXA_LATENCY_WINDOW = int(os.getenv("DXA_LATENCY_WINDOW", "200"))
+DXA_BREAKER_FAILURE_THRESHOLD = int(os.getenv("DXA_BREAKER_FAILURE_THRESHOLD", "5"))
+DXA_BREAKER_RESET_SECONDS = float(os.getenv("DXA_BREAKER_RESET_SECONDS", "30"))
+
+# AIKO会話プール (未指定時はAIKO_CONVERSATION_IDのみを使用)
+AIKO_CONVERSATION_IDS = [
+    conversation_id.strip()
+    for conversation_id in os.getenv("AIKO_CONVERSATION_IDS", AIKO_CONVERSATION_ID or "").split(",")
+    if conversation_id.strip()
+]
+AIKO_CONVERSATION_POOL_SIZE = int(os.getenv("AIKO_CONVERSATION_POOL_SIZE", "8"))
+AIKO_CONVERSATION_MAX_MESSAGES = int(os.getenv("AIKO_CONVERSATION_MAX_MESSAGES", "20"))
+# 会話の作成に失敗した後、次に作成を試みるまでの秒数
+AIKO_CONVERSATION_CREATE_BACKOFF_SECONDS = float(os.getenv("AIKO_CONVERSATION_CREATE_BACKOFF_SECONDS", "30"))
+
+# Vector Storeへのファイル取り込みジョブ
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "4"))
+INGESTION_RETRY_BASE_SECONDS = float(os.getenv("INGESTION_RETRY_BASE_SECONDS", "5"))
+INGESTION_JOB_HISTORY = int(os.getenv("INGESTION_JOB_HISTORY", "500"))
+
+# イベントループのブロッキング検出 (ウォッチドッグ)
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "false").lower() == "true"
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "100"))
+LOOP_LAG_PROBE_INTERVAL_MS = float(os.getenv("LOOP_LAG_PROBE_INTERVAL_MS", "500"))
+
+# Vector Store一覧のバックグラウンド更新間隔
+VECTOR_STORE_REFRESH_SECONDS = float(os.getenv("VECTOR_STORE_REFRESH_SECONDS", "300"))
+
+# スレッド履歴 (/api/threads/{thread_id}/messages) のページキャッシュ
+THREAD_HISTORY_CACHE_PAGES = int(os.getenv("THREAD_HISTORY_CACHE_PAGES", "256"))
+THREAD_HISTORY_CACHE_TTL_SECONDS = float(os.getenv("THREAD_HISTORY_CACHE_TTL_SECONDS", "300"))
+
+# Runのトレース (DATA_DIR/run_traces.jsonl) の最大サイズ。超えると1世代ローテーションする
+RUN_TRACE_MAX_BYTES = int(os.getenv("RUN_TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# バッチ質問 (/api/chat/batch)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "5"))
+
+# リクエスト単位のプロファイリング (未設定の場合は無効)
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "5"))
+PROFILING_MAX_REPORTS = int(os.getenv("PROFILING_MAX_REPORTS", "50"))
+
+# ログ出力
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" または "text"
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.1"))
@@ -1,8 +1,111 @@
+import atexit
+import json
 import logging
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from settings import env
 
-# ロギングの設定を強化
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)'
-)
+# ログに付与する相関ID (request_id, thread_id, run_id など)
+_log_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+
+def bind_log_context(**fields):
+    """現在のコンテキストのログに相関IDを追加する。戻り値はreset_log_contextに渡す"""
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def reset_log_context(token):
+    try:
+        _log_context.reset(token)
+    except ValueError:
+        # 非同期ジェネレータが別のコンテキストで終了された場合 (シャットダウン時など)
+        pass
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    レコードをキューに積むだけのハンドラ。
+    メッセージの組み立てと出力はリスナーのスレッドで行い、イベントループを塞がない。
+    """
+
+    def prepare(self, record):
+        # コンテキスト変数は呼び出し元でしか参照できないため、ここで取り出しておく
+        record.context = _log_context.get()
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "location": f"{record.filename}:{record.lineno}",
+            **getattr(record, "context", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)')
+
+    def format(self, record):
+        message = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            message += " [" + " ".join(f"{key}={value}" for key, value in context.items()) + "]"
+        return message
+
+
+class _Payload:
+    """ログ出力時に初めてシリアライズされるペイロード (最大文字数で切り詰める)"""
+
+    def __init__(self, payload, max_chars: int):
+        self.payload = payload
+        self.max_chars = max_chars
+
+    def __str__(self):
+        payload = self.payload
+        if hasattr(payload, "model_dump"):
+            payload = payload.model_dump()
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... (truncated, {len(text)} chars)"
+        return text
+
+
+def log_payload(label: str, payload, level: int = logging.INFO):
+    """
+    ツール呼び出しやDXAの応答などの大きなペイロードをログに出す。
+    LOG_PAYLOAD_SAMPLE_RATE の割合だけ出力し、LOG_PAYLOAD_MAX_CHARS 文字で切り詰める。
+    """
+    if not logger.isEnabledFor(level) or random.random() >= env.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    logger.log(level, "%s: %s", label, _Payload(payload, env.LOG_PAYLOAD_MAX_CHARS), stacklevel=2)
+
+
+def _configure():
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if env.LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(env.LOG_LEVEL)
+    root.addHandler(_ContextQueueHandler(log_queue))
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # 終了時にキューに残ったログを書き出す
+    atexit.register(listener.stop)
+
+
+_configure()
 logger = logging.getLogger(__name__)
@@ -0,0 +1,32 @@
+import asyncio
+
+# イベントループのコールバック実行を観測するフック。
+# 観測者が登録されている間だけHandle._runを差し替え、それ以外のときはオーバーヘッドをかけない。
+_original_run = asyncio.events.Handle._run
+_observers = []
+
+
+def _observed_run(self):
+    observers = list(_observers)
+    for observer in observers:
+        observer.callback_started(self)
+    try:
+        _original_run(self)
+    finally:
+        for observer in observers:
+            observer.callback_finished(self)
+
+
+def add_observer(observer):
+    """callback_started(handle) と callback_finished(handle) を持つオブジェクトを登録する"""
+    if observer in _observers:
+        return
+    _observers.append(observer)
+    asyncio.events.Handle._run = _observed_run
+
+
+def remove_observer(observer):
+    if observer in _observers:
+        _observers.remove(observer)
+    if not _observers:
+        asyncio.events.Handle._run = _original_run
@@ -0,0 +1,129 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from settings import env
+from utils import loop_hooks
+from utils.log import logger
+from utils.metrics import registry
+from utils.request_context import current_request, describe_route
+
+LOOP_LAG = registry.gauge(
+    "event_loop_lag_seconds",
+    "Most recent event loop scheduling lag measured by the probe task",
+)
+LOOP_LAG_HISTOGRAM = registry.histogram(
+    "event_loop_lag_observed_seconds",
+    "Event loop scheduling lag measured by the probe task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = registry.counter(
+    "event_loop_stalls_total",
+    "Callbacks that blocked the event loop longer than the threshold",
+    ("route",),
+)
+LOOP_STALL_DURATION = registry.histogram(
+    "event_loop_stall_duration_seconds",
+    "Duration of callbacks that blocked the event loop longer than the threshold",
+    ("route",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+class LoopMonitor:
+    """
+    イベントループを塞いでいるコールバックを検出するウォッチドッグ。
+    しきい値を超えて実行中のコールバックは監視スレッドからスタックを取得し、
+    終了時にリクエストのルートと共にログとメトリクスに記録する。
+    """
+
+    def __init__(self, threshold_seconds: float, probe_interval_seconds: float):
+        self.threshold = threshold_seconds
+        self.probe_interval = probe_interval_seconds
+        self._loop_thread_id = None
+        # 実行中のコールバック: (handle, 開始時刻)。監視スレッドから参照するため1つのタプルで更新する
+        self._current = None
+        self._captured_stacks = {}
+        self._stop = threading.Event()
+        self._watchdog = None
+        self._probe_task = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop_thread_id = threading.get_ident()
+        if isinstance(loop, asyncio.BaseEventLoop):
+            loop_hooks.add_observer(self)
+        else:
+            # uvloopなどではコールバック単位の計測ができないため、遅延の計測のみ行う
+            logger.warning("Loop monitor: %s does not support callback hooks, only measuring lag",
+                           type(loop).__name__)
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        self._probe_task = loop.create_task(self._probe())
+        logger.info("Loop monitor started (threshold=%.0fms)", self.threshold * 1000)
+
+    def stop(self):
+        loop_hooks.remove_observer(self)
+        self._stop.set()
+        if self._probe_task:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    def callback_started(self, handle):
+        self._current = (handle, time.perf_counter())
+
+    def callback_finished(self, handle):
+        current = self._current
+        self._current = None
+        if current is None or current[0] is not handle:
+            return
+        duration = time.perf_counter() - current[1]
+        if duration < self.threshold:
+            return
+
+        stack = self._captured_stacks.pop(id(handle), None)
+        try:
+            route = describe_route(handle._context.get(current_request))
+        except AttributeError:
+            route = None
+        route = route or "background"
+        LOOP_STALLS.labels(route=route).inc()
+        LOOP_STALL_DURATION.labels(route=route).observe(duration)
+        logger.warning(
+            "Event loop blocked for %.0fms by %r (route=%s)\n%s",
+            duration * 1000, handle, route,
+            stack or "(stack not captured)"
+        )
+
+    def _watch(self):
+        """監視スレッド: しきい値を超えて実行中のコールバックのスタックを取得する"""
+        interval = max(self.threshold / 2, 0.005)
+        while not self._stop.wait(interval):
+            current = self._current
+            if current is None:
+                continue
+            handle, started = current
+            if time.perf_counter() - started < self.threshold or id(handle) in self._captured_stacks:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if len(self._captured_stacks) > 100:
+                # 終了処理と競合して回収されなかったスタックを破棄する
+                self._captured_stacks.clear()
+            if frame is not None:
+                self._captured_stacks[id(handle)] = "".join(traceback.format_stack(frame))
+
+    async def _probe(self):
+        """一定間隔でスリープし、予定より遅れて再開した時間をループの遅延として記録する"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.probe_interval)
+            lag = max(0.0, time.perf_counter() - started - self.probe_interval)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+loop_monitor = LoopMonitor(
+    threshold_seconds=env.LOOP_STALL_THRESHOLD_MS / 1000,
+    probe_interval_seconds=env.LOOP_LAG_PROBE_INTERVAL_MS / 1000,
+)
@@ -0,0 +1,280 @@
+import asyncio
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from urllib.parse import parse_qs
+import aiofiles
+from settings import env
+from utils import loop_hooks
+from utils.log import logger
+from utils.request_context import describe_route
+
+# プロファイル対象のリクエストのコンテキストに設定される
+current_profile: ContextVar["RequestProfile | None"] = ContextVar("current_profile", default=None)
+
+# スタックの取得対象外とするフレーム (フック自身とイベントループの内部)
+_HOOK_CODE = loop_hooks._observed_run.__code__
+
+
+def is_admin_token(token: str | None) -> bool:
+    """管理者トークンを確認する (PROFILING_ADMIN_TOKEN未設定時は常に拒否)"""
+    if not env.PROFILING_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), env.PROFILING_ADMIN_TOKEN.encode())
+
+
+class RequestProfile:
+    """1リクエスト分のサンプリング結果"""
+
+    def __init__(self, route: str):
+        self.id = uuid.uuid4().hex
+        self.route = route
+        self.started_at = datetime.now().isoformat()
+        self.started = time.perf_counter()
+        self.finished = None
+        # イベントループ上でこのリクエストのコールバックを実行していた時間
+        self.on_loop_seconds = 0.0
+        self.callbacks = 0
+        self.stacks = Counter()
+
+    @property
+    def active(self) -> bool:
+        return self.finished is None
+
+    def report(self, sample_interval: float) -> dict:
+        wall = (self.finished or time.perf_counter()) - self.started
+        samples = sum(self.stacks.values())
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+
+        def top(counts):
+            return [
+                {"function": frame, "samples": count, "seconds": round(count * sample_interval, 4)}
+                for frame, count in counts.most_common(30)
+            ]
+
+        return {
+            "profile_id": self.id,
+            "route": self.route,
+            "started_at": self.started_at,
+            "wall_seconds": round(wall, 4),
+            "on_loop_seconds": round(self.on_loop_seconds, 4),
+            # イベントループ外 (OpenAI/AIKOの応答待ち、スレッドでの処理など) の時間
+            "waiting_seconds": round(max(0.0, wall - self.on_loop_seconds), 4),
+            "callbacks": self.callbacks,
+            "sample_interval_ms": sample_interval * 1000,
+            "samples": samples,
+            "top_self": top(self_counts),
+            "top_cumulative": top(total_counts),
+            # flamegraph.pl / speedscope で読み込める折り畳み形式
+            "collapsed": dict(self.stacks.most_common()),
+        }
+
+
+class RequestProfiler:
+    """
+    指定したリクエストだけをサンプリングするプロファイラ。
+    プロファイル中のリクエストがある間だけループのフックとサンプリングスレッドを動かし、
+    それ以外のリクエストにはオーバーヘッドをかけない。
+    """
+
+    def __init__(self, sample_interval_seconds: float):
+        self.sample_interval = sample_interval_seconds
+        self._profiles: set[RequestProfile] = set()
+        self._loop_thread_id = None
+        # 実行中のコールバック: (profile, handle, 開始時刻)
+        self._running = None
+        self._sampler = None
+        self._stop = None
+
+    def start(self, route: str) -> RequestProfile:
+        profile = RequestProfile(route)
+        self._profiles.add(profile)
+        if len(self._profiles) == 1:
+            loop = asyncio.get_running_loop()
+            if not isinstance(loop, asyncio.BaseEventLoop):
+                # uvloopなどではコールバックのフックが呼ばれないため、経過時間のみ記録される
+                logger.warning("Request profiler: %s does not support callback hooks, no samples will be taken",
+                               type(loop).__name__)
+            self._loop_thread_id = threading.get_ident()
+            loop_hooks.add_observer(self)
+            # 停止直後に再開した場合に前のスレッドが動き続けないよう、スレッド毎にEventを用意する
+            self._stop = threading.Event()
+            self._sampler = threading.Thread(
+                target=self._sample, args=(self._stop,), name="request-profiler", daemon=True
+            )
+            self._sampler.start()
+        return profile
+
+    def finish(self, profile: RequestProfile) -> dict:
+        profile.finished = time.perf_counter()
+        self._profiles.discard(profile)
+        if not self._profiles and self._stop is not None:
+            loop_hooks.remove_observer(self)
+            self._stop.set()
+            self._stop = None
+            self._sampler = None
+        return profile.report(self.sample_interval)
+
+    def callback_started(self, handle):
+        try:
+            profile = handle._context.get(current_profile)
+        except AttributeError:
+            return
+        if profile is not None and profile.active:
+            self._running = (profile, handle, time.perf_counter())
+
+    def callback_finished(self, handle):
+        running = self._running
+        if running is None or running[1] is not handle:
+            return
+        self._running = None
+        profile, _, started = running
+        profile.on_loop_seconds += time.perf_counter() - started
+        profile.callbacks += 1
+
+    def _sample(self, stop: threading.Event):
+        """サンプリングスレッド: 対象のコールバック実行中にループのスレッドのスタックを記録する"""
+        while not stop.wait(self.sample_interval):
+            running = self._running
+            if running is None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None or self._running is not running:
+                continue
+            stack = _collapse(frame)
+            if stack:
+                running[0].stacks[stack] += 1
+
+
+def _collapse(frame) -> str:
+    """フックより内側のフレームを 外側;...;内側 の形式にまとめる"""
+    frames = []
+    while frame is not None and frame.f_code is not _HOOK_CODE:
+        code = frame.f_code
+        module = frame.f_globals.get("__name__", "?")
+        frames.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    if frame is None:
+        # フックの外で取得したスタック (コールバックの切り替わりと競合した場合) は捨てる
+        return ""
+    # 先頭はループ内部 (Handle._run, Context.run) のため除く
+    return ";".join(reversed(frames[:-1]))
+
+
+class ProfileStore:
+    """プロファイル結果をDATA_DIR/profilesにJSONで保存する"""
+
+    def __init__(self, directory: str, max_reports: int):
+        self.directory = directory
+        self.max_reports = max_reports
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    async def save(self, report: dict):
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+        async with aiofiles.open(self._path(report["profile_id"]), "w", encoding="utf-8") as f:
+            await f.write(json.dumps(report, ensure_ascii=False, indent=2))
+        await asyncio.to_thread(self._prune)
+
+    async def load(self, profile_id: str) -> dict | None:
+        # IDはuuid4().hexのみ許可し、パスの指定に使われないようにする
+        if len(profile_id) != 32 or not all(c in "0123456789abcdef" for c in profile_id):
+            return None
+        path = self._path(profile_id)
+        if not os.path.exists(path):
+            return None
+        async with aiofiles.open(path, "r", encoding="utf-8") as f:
+            return json.loads(await f.read())
+
+    def _entries(self) -> list[os.DirEntry]:
+        if not os.path.isdir(self.directory):
+            return []
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+        return sorted(entries, key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+    async def list_profiles(self) -> list[dict]:
+        entries = await asyncio.to_thread(self._entries)
+        return [
+            {
+                "profile_id": entry.name[:-len(".json")],
+                "created_at": datetime.fromtimestamp(entry.stat().st_mtime).isoformat(),
+                "size": entry.stat().st_size,
+            }
+            for entry in entries
+        ]
+
+    def _prune(self):
+        for entry in self._entries()[self.max_reports:]:
+            os.remove(entry.path)
+
+
+class ProfilingMiddleware:
+    """
+    管理者トークン付きで X-Profile ヘッダー (または profile クエリパラメータ) が
+    指定されたリクエストをプロファイルする。レスポンスの送信完了
+    (ストリーミングの場合は最後のチャンクの送信) までを対象とし、
+    結果のIDを X-Profile-Id ヘッダーで返す。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not env.PROFILING_ADMIN_TOKEN or not _profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = request_profiler.start(describe_route(scope))
+        token = current_profile.set(profile)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile.id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            current_profile.reset(token)
+            # ルーティング後のルート名で記録する
+            profile.route = describe_route(scope)
+            report = request_profiler.finish(profile)
+            try:
+                await profile_store.save(report)
+                logger.info("Saved request profile %s for %s (%.3fs)",
+                            profile.id, profile.route, report["wall_seconds"])
+            except Exception as e:
+                logger.error("Error saving request profile: %s", e)
+
+
+def _profile_requested(scope) -> bool:
+    headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    requested = headers.get("x-profile") or (query.get("profile") or [None])[0]
+    if requested not in ("1", "true"):
+        return False
+    token = headers.get("x-admin-token") or (query.get("admin_token") or [None])[0]
+    return is_admin_token(token)
+
+
+request_profiler = RequestProfiler(sample_interval_seconds=env.PROFILING_SAMPLE_INTERVAL_MS / 1000)
+profile_store = ProfileStore(
+    directory=os.path.join(env.DATA_DIR, "profiles"),
+    max_reports=env.PROFILING_MAX_REPORTS,
+)
@@ -0,0 +1,59 @@
+import uuid
+from contextvars import ContextVar
+from utils.log import bind_log_context, reset_log_context
+
+# 処理中のリクエストのASGIスコープ
+current_request: ContextVar[dict | None] = ContextVar("current_request", default=None)
+
+
+def describe_route(scope: dict | None) -> str | None:
+    """スコープからルートを表す文字列 ("GET /api/files/{file_id}" など) を作る"""
+    if not scope:
+        return None
+    # どのルートにも一致しない (またはルーティング前の) リクエストは、URLの走査などでラベルが
+    # 無制限に増えないよう固定の値にまとめる
+    if "route" not in scope and "endpoint" not in scope:
+        return "unmatched"
+    # ルーティング後はパスパラメータを名前に置き換え、IDごとにラベルが増えないようにする
+    names = {str(value): name for name, value in (scope.get("path_params") or {}).items()}
+    path = "/".join(
+        f"{{{names[segment]}}}" if segment in names else segment
+        for segment in scope.get("path", "").split("/")
+    )
+    return f'{scope.get("method")} {path}'
+
+
+class RequestContextMiddleware:
+    """
+    リクエスト毎のコンテキスト変数 (ASGIスコープ、ログのrequest_id) を設定するASGIミドルウェア。
+    ストリーミングレスポンスの生成中も同じコンテキストが引き継がれる。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # 呼び出し元から渡されたIDがあれば引き継ぎ、ログの相関IDとして使う
+        request_id = None
+        for key, value in scope["headers"]:
+            if key.lower() == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = current_request.set(scope)
+        log_token = bind_log_context(request_id=request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            reset_log_context(log_token)
+            current_request.reset(token)
@@ -0,0 +1,75 @@
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:  # orjsonが無い環境では標準のjsonを使用
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotliが無い環境ではgzipのみ対応
+    brotli = None
+
+
+def dumps_line(obj) -> bytes:
+    """オブジェクトをNDJSONの1行 (UTF-8) にエンコードする"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            # orjsonが扱えない型が含まれる場合は標準のjsonにフォールバック
+            pass
+    return (json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+
+
+class GzipStreamCompressor:
+    encoding = "gzip"
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        # イベント毎にSYNC_FLUSHし、クライアントが即座に展開できるようにする
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStreamCompressor:
+    encoding = "br"
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=min(level, 11), mode=brotli.MODE_TEXT)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def _accepted_encodings(accept_encoding: str | None) -> set[str]:
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name)
+    return accepted
+
+
+def negotiate_compressor(accept_encoding: str | None, enabled: bool = True, level: int = 6):
+    """Accept-Encodingヘッダーからストリーム用の圧縮方式を選択する (brotli優先)"""
+    if not enabled:
+        return None
+    accepted = _accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return BrotliStreamCompressor(level)
+    if "gzip" in accepted:
+        return GzipStreamCompressor(level)
+    return None
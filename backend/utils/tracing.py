@@ -0,0 +1,109 @@
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from utils.metrics import CHAT_STAGE_DURATION
+
+# 処理中のRunのトレース (チャット・バッチの各質問毎に設定される)
+current_trace: ContextVar["RunTrace | None"] = ContextVar("current_trace", default=None)
+
+
+class RunTrace:
+    """
+    1回のRunの処理段階 (span) の記録。
+    開始時刻はトレース開始からの経過秒数で保持する。
+    """
+
+    def __init__(self, source: str, model: str):
+        self.trace_id = uuid.uuid4().hex
+        self.source = source
+        self.model = model
+        self.thread_id = None
+        self.run_id = None
+        self.status = None
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.wall_seconds = None
+        self.spans = []
+        self._token = None
+        # ポーリングなど回数の多い段階は回数と合計時間のみ記録する
+        self.aggregates = {}
+
+    def offset(self, perf_counter_value: float) -> float:
+        return perf_counter_value - self._started
+
+    def add_span(self, name: str, start: float, duration: float, **attributes):
+        self.spans.append({
+            "name": name,
+            "start": round(start, 4),
+            "duration": round(duration, 4),
+            **attributes,
+        })
+
+    def add_aggregate(self, name: str, duration: float):
+        aggregate = self.aggregates.setdefault(name, {"count": 0, "seconds": 0.0})
+        aggregate["count"] += 1
+        aggregate["seconds"] = round(aggregate["seconds"] + duration, 4)
+
+    def finish(self, status: str):
+        self.status = status
+        self.wall_seconds = round(time.perf_counter() - self._started, 4)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "source": self.source,
+            "model": self.model,
+            "thread_id": self.thread_id,
+            "run_id": self.run_id,
+            "status": self.status,
+            "started_at": self.started_at,
+            "wall_seconds": self.wall_seconds,
+            "spans": self.spans,
+            "aggregates": self.aggregates,
+        }
+
+
+def begin_trace(source: str, model: str) -> RunTrace:
+    """トレースを開始し、現在のコンテキストに設定する。終了時はend_traceを呼ぶ"""
+    trace = RunTrace(source, model)
+    trace._token = current_trace.set(trace)
+    return trace
+
+
+def end_trace(trace: RunTrace, status: str):
+    trace.finish(status)
+    try:
+        current_trace.reset(trace._token)
+    except ValueError:
+        # 非同期ジェネレータが別のコンテキストで終了された場合 (シャットダウン時など)
+        pass
+
+
+def annotate_trace(**fields):
+    """現在のトレースにthread_id・run_idを設定する"""
+    trace = current_trace.get()
+    if trace:
+        for key, value in fields.items():
+            setattr(trace, key, value)
+
+
+@contextmanager
+def trace_stage(name: str, aggregate: bool = False):
+    """
+    処理段階の時間を現在のトレースとメトリクス (chat_stage_duration_seconds) に記録する。
+    メトリクスはチャットの処理のみを対象とし、バッチなど他の経路のトレース中は記録しない。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        trace = current_trace.get()
+        if trace is None or trace.source == "chat":
+            CHAT_STAGE_DURATION.labels(stage=name).observe(duration)
+        if trace:
+            if aggregate:
+                trace.add_aggregate(name, duration)
+            else:
+                trace.add_span(name, trace.offset(start), duration)
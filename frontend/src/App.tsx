@@ -18,6 +18,7 @@ import {
   MenuItem,
   FormControl,
   InputLabel,
+  LinearProgress,
 } from '@mui/material';
 import { 
   Send as SendIcon,
@@ -25,6 +26,7 @@ import {
   Delete as DeleteIcon,
   ImageOutlined as ImageIcon,
   Download as DownloadIcon,
+  Close as CloseIcon,
 } from '@mui/icons-material';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
@@ -32,7 +34,7 @@ import { useChat } from './hooks/useChat';
 import { useFileManager } from './hooks/useFileManager';
 import { useSystemInfo } from './hooks/useSystemInfo';
 import { useScrollToBottom } from './hooks/useScrollToBottom';
-import { FileInfo, ImageDetailLevel } from './types';
+import { FileInfo, ImageDetailLevel, UploadJob } from './types';
 import DxaDebugResponse from './components/DxaDebugResponse';
 
 /* Add back the CustomCodeProps interface without comment */
@@ -62,11 +64,17 @@ function App() {
     thinkingText,
     dxaResponse,
     setDxaResponse,
+    loadHistory,
+    loadOlderMessages,
+    hasMoreHistory,
   } = useChat();
 
   const {
     files,
     isUploading,
+    uploadJobs,
+    uploadError,
+    dismissUploadJob,
     fetchFiles,
     uploadFile,
     deleteFile
@@ -75,6 +83,7 @@ function App() {
   const {
     assistantId,
     vectorStoreId,
+    threadId,
     initializationStatus,
     initializeAssistant
   } = useSystemInfo();
@@ -98,6 +107,13 @@ function App() {
     fetchFiles();
   }, [initializeAssistant, fetchFiles]);
 
+  // スレッドが確定したら会話履歴を読み込む (リロード時の復元)
+  useEffect(() => {
+    if (threadId) {
+      loadHistory(threadId);
+    }
+  }, [threadId, loadHistory]);
+
   // メッセージ送信ハンドラー
   const handleSend = () => {
     sendMessage();
@@ -291,6 +307,63 @@ function App() {
               />
             </Button>
 
+            {uploadError && (
+              <Typography variant="body2" color="error" sx={{ mb: 2 }}>
+                {uploadError}
+              </Typography>
+            )}
+
+            {/* 取り込みジョブの進行状況 */}
+            {uploadJobs.length > 0 && (
+              <List dense sx={{ mb: 2 }}>
+                {uploadJobs.map((job: UploadJob) => {
+                  const finished = job.status === 'succeeded' || job.status === 'failed';
+                  return (
+                    <ListItem
+                      key={job.job_id}
+                      sx={{ display: 'block', borderBottom: '1px solid', borderColor: 'divider' }}
+                      secondaryAction={finished && (
+                        <IconButton
+                          edge="end"
+                          size="small"
+                          onClick={() => dismissUploadJob(job.job_id)}
+                          aria-label="dismiss"
+                        >
+                          <CloseIcon fontSize="small" />
+                        </IconButton>
+                      )}
+                    >
+                      <ListItemText
+                        primary={job.filename}
+                        secondary={
+                          job.status === 'retrying'
+                            ? `retrying (${job.attempts}/${job.max_attempts})`
+                            : job.status
+                        }
+                        sx={{
+                          wordBreak: 'break-all',
+                          '& .MuiListItemText-secondary': {
+                            fontSize: '0.75rem',
+                            color: job.status === 'failed' ? 'error.main' : 'text.secondary'
+                          }
+                        }}
+                      />
+                      {!finished && <LinearProgress sx={{ mt: 0.5 }} />}
+                      {job.error && (
+                        <Typography
+                          variant="caption"
+                          color={job.status === 'failed' ? 'error' : 'text.secondary'}
+                          sx={{ display: 'block', wordBreak: 'break-all' }}
+                        >
+                          {job.error.message}
+                        </Typography>
+                      )}
+                    </ListItem>
+                  );
+                })}
+              </List>
+            )}
+
             {files.length > 0 ? (
               <List>
                 {files.map((file: FileInfo) => (
@@ -382,6 +455,13 @@ function App() {
                 borderRadius: '4px'
               }
             }}>
+              {hasMoreHistory && (
+                <ListItem sx={{ justifyContent: 'center' }}>
+                  <Button size="small" onClick={loadOlderMessages}>
+                    以前のメッセージを読み込む
+                  </Button>
+                </ListItem>
+              )}
               {messages.map((message, index) => (
                 <ListItem 
                   key={index} 
@@ -1,5 +1,24 @@
 import { useState, useCallback } from 'react';
-import { DxaResponse, Message, ImageDetailLevel } from '../types';
+import { DxaResponse, Message, ImageDetailLevel, ThreadMessage, ThreadMessagePage } from '../types';
+
+// 接続が切れた場合に再開を試みる回数と待機時間
+const MAX_RESUME_ATTEMPTS = 5;
+const RESUME_DELAY_MS = 1000;
+// 履歴を1回に読み込む件数
+const HISTORY_PAGE_SIZE = 20;
+
+const toMessage = (message: ThreadMessage): Message => ({
+  text: message.text,
+  isUser: message.role === 'user',
+});
+
+interface StreamState {
+  streamId: string | null;
+  lastEventId: number;
+  completed: boolean;
+  // 再開しようとしたイベントが既にサーバのバッファから押し出されている
+  expired: boolean;
+}
 
 export const useChat = () => {
   const [messages, setMessages] = useState<Message[]>([]);
@@ -9,8 +28,47 @@ export const useChat = () => {
   const [imageDetailLevel, setImageDetailLevel] = useState<ImageDetailLevel>('auto');
   const [thinkingText, setThinkingText] = useState<string>("Thinking...");
   const [dxaResponse, setDxaResponse] = useState<DxaResponse | null>(null);
+  const [historyThreadId, setHistoryThreadId] = useState<string | null>(null);
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
+  const [hasMoreHistory, setHasMoreHistory] = useState(false);
+
+  // 新しい順にページを取得し、古いメッセージを先頭に追加する
+  // (ETagによりブラウザのキャッシュが再検証されるため、変更がなければ304で返る)
+  const fetchHistoryPage = useCallback(async (threadId: string, cursor: string | null) => {
+    const params = new URLSearchParams({ limit: String(HISTORY_PAGE_SIZE), order: 'desc' });
+    if (cursor) params.set('after', cursor);
+    const response = await fetch(`/api/threads/${threadId}/messages?${params}`);
+    if (!response.ok) {
+      throw new Error('Failed to fetch thread history');
+    }
+    const page: ThreadMessagePage = await response.json();
+    const older = page.messages.slice().reverse().map(toMessage);
+    setMessages(prev => [...older, ...prev]);
+    setHistoryCursor(page.next_cursor);
+    setHasMoreHistory(page.has_more);
+  }, []);
+
+  const loadHistory = useCallback(async (threadId: string) => {
+    if (!threadId || threadId === historyThreadId) return;
+    try {
+      setHistoryThreadId(threadId);
+      setMessages([]);
+      await fetchHistoryPage(threadId, null);
+    } catch (error) {
+      console.error('Error loading history:', error);
+    }
+  }, [historyThreadId, fetchHistoryPage]);
+
+  const loadOlderMessages = useCallback(async () => {
+    if (!historyThreadId || !historyCursor) return;
+    try {
+      await fetchHistoryPage(historyThreadId, historyCursor);
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    }
+  }, [historyThreadId, historyCursor, fetchHistoryPage]);
 
-  const processStream = async (response: Response) => {
+  const processStream = async (response: Response, state: StreamState) => {
     const reader = response.body?.getReader();
     if (!reader) return;
 
@@ -31,6 +89,11 @@ export const useChat = () => {
           
           try {
             const event = JSON.parse(line);
+            if (typeof event.id === 'number') {
+              // 再送されたイベントの重複処理を避ける
+              if (event.id <= state.lastEventId) continue;
+              state.lastEventId = event.id;
+            }
             switch (event.type) {
               case 'thinking':
                 setThinkingText(event.data);
@@ -53,6 +116,11 @@ export const useChat = () => {
                   files: event.data.files,
                   isDxaResponse: event.data.isDxaResponse
                 }]);
+                state.completed = true;
+                break;
+              case 'gap':
+                // 途中経過のイベントが欠落した (完了イベントは最後に送られるため受信できる)
+                console.warn('Stream events lost:', event.data);
                 break;
             }
             console.log('Event data:', event.data);
@@ -141,7 +209,49 @@ export const useChat = () => {
         throw new Error('Network response was not ok');
       }
 
-      await processStream(response);
+      const state: StreamState = {
+        streamId: response.headers.get('X-Stream-Id'),
+        lastEventId: 0,
+        completed: false,
+        expired: false,
+      };
+      try {
+        await processStream(response, state);
+      } catch (streamError) {
+        console.warn('Stream interrupted:', streamError);
+      }
+
+      // 完了前に接続が切れた場合は、最後に受信したイベントIDから再開する
+      let attempts = 0;
+      while (!state.completed && state.streamId && attempts < MAX_RESUME_ATTEMPTS) {
+        attempts++;
+        await new Promise(resolve => setTimeout(resolve, RESUME_DELAY_MS));
+        try {
+          const resumed = await fetch(`/api/chat/streams/${state.streamId}`, {
+            headers: { 'Last-Event-ID': String(state.lastEventId) },
+          });
+          if (resumed.status === 404) break;
+          if (resumed.status === 410) {
+            state.expired = true;
+            break;
+          }
+          if (!resumed.ok) continue;
+          await processStream(resumed, state);
+        } catch (resumeError) {
+          console.warn('Stream resume failed:', resumeError);
+        }
+      }
+
+      if (state.expired) {
+        setMessages(prev => [...prev, {
+          text: '応答の受信が中断されました。履歴を再読み込みして結果を確認してください。',
+          isUser: false,
+        }]);
+        return;
+      }
+      if (!state.completed) {
+        throw new Error('Stream ended before completion');
+      }
     } catch (error) {
       console.error('Error:', error);
       setMessages(prev => [...prev, {
@@ -175,5 +285,8 @@ export const useChat = () => {
     setDxaResponse,
     sendMessage,
     clearMessages,
+    loadHistory,
+    loadOlderMessages,
+    hasMoreHistory,
   };
 }; 
\ No newline at end of file
@@ -1,9 +1,16 @@
 import { useState, useCallback, useEffect } from 'react';
-import { FileInfo } from '../types';
+import { FileInfo, UploadJob } from '../types';
+
+// 取り込みジョブの状態を確認する間隔
+const JOB_POLL_INTERVAL_MS = 2000;
+// 通信エラー時に再試行する間隔の上限
+const JOB_POLL_MAX_INTERVAL_MS = 30000;
 
 export const useFileManager = () => {
   const [files, setFiles] = useState<FileInfo[]>([]);
   const [isUploading, setIsUploading] = useState(false);
+  const [uploadJobs, setUploadJobs] = useState<UploadJob[]>([]);
+  const [uploadError, setUploadError] = useState<string | null>(null);
 
   const fetchFiles = useCallback(async () => {
     try {
@@ -25,6 +32,48 @@ export const useFileManager = () => {
     }
   }, []);
 
+  // ジョブが完了するまで状態を確認し、完了したらファイル一覧を更新する
+  // (通信エラー時は間隔を延ばして再試行し、ジョブが存在しない場合のみ確認をやめる)
+  const watchUploadJob = useCallback(async (jobId: string) => {
+    let delay = JOB_POLL_INTERVAL_MS;
+    while (true) {
+      try {
+        const response = await fetch(`/api/upload/jobs/${jobId}`);
+        if (response.status === 404) {
+          setUploadJobs(prev => prev.filter(j => j.job_id !== jobId));
+          setUploadError('アップロードのジョブが見つかりません');
+          return;
+        }
+        if (!response.ok) {
+          throw new Error(`Failed to fetch upload job: ${response.statusText}`);
+        }
+        const job: UploadJob = await response.json();
+        setUploadJobs(prev => [job, ...prev.filter(j => j.job_id !== jobId)]);
+        setUploadError(null);
+        delay = JOB_POLL_INTERVAL_MS;
+
+        if (job.status === 'succeeded') {
+          await fetchFiles();
+          return;
+        }
+        if (job.status === 'failed') {
+          console.error('Upload job failed:', job.error);
+          return;
+        }
+      } catch (error) {
+        console.error('Error checking upload job:', error);
+        setUploadError('アップロードの状態を取得できません。再試行しています...');
+        delay = Math.min(delay * 2, JOB_POLL_MAX_INTERVAL_MS);
+      }
+      await new Promise(resolve => setTimeout(resolve, delay));
+    }
+  }, [fetchFiles]);
+
+  // 完了・失敗したジョブを一覧から消す
+  const dismissUploadJob = useCallback((jobId: string) => {
+    setUploadJobs(prev => prev.filter(j => j.job_id !== jobId));
+  }, []);
+
   const uploadFile = useCallback(async (file: File) => {
     if (isUploading) return false;
 
@@ -33,6 +82,7 @@ export const useFileManager = () => {
 
     try {
       setIsUploading(true);
+      setUploadError(null);
       const response = await fetch('/api/upload', {
         method: 'POST',
         body: formData,
@@ -43,19 +93,21 @@ export const useFileManager = () => {
       }
 
       const result = await response.json();
-      if (result.message !== "File uploaded successfully") {
+      if (!result.job_id) {
         throw new Error('Unexpected server response');
       }
 
-      await fetchFiles();
+      // 取り込みはサーバー側で非同期に行われるため、完了を待たずに戻る
+      watchUploadJob(result.job_id);
       return true;
     } catch (error) {
       console.error('Error uploading file:', error);
+      setUploadError(`${file.name} のアップロードに失敗しました`);
       return false;
     } finally {
       setIsUploading(false);
     }
-  }, [fetchFiles, isUploading]);
+  }, [watchUploadJob, isUploading]);
 
   const deleteFile = useCallback(async (fileId: string) => {
     try {
@@ -87,6 +139,9 @@ export const useFileManager = () => {
   return {
     files,
     isUploading,
+    uploadJobs,
+    uploadError,
+    dismissUploadJob,
     fetchFiles,
     uploadFile,
     deleteFile
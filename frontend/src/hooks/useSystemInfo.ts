@@ -3,6 +3,7 @@ import { useState, useCallback } from 'react';
 export const useSystemInfo = () => {
   const [assistantId, setAssistantId] = useState<string>('');
   const [vectorStoreId, setVectorStoreId] = useState<string>('');
+  const [threadId, setThreadId] = useState<string>('');
   const [initializationStatus, setInitializationStatus] = useState<string>('');
   const [isInitializing, setIsInitializing] = useState(false);
 
@@ -20,6 +21,7 @@ export const useSystemInfo = () => {
       if (data.assistant_id) {
         setAssistantId(data.assistant_id);
         setVectorStoreId(data.vector_store_id);
+        setThreadId(data.thread_id || '');
         setInitializationStatus('Initialization successful');
       } else {
         throw new Error('Failed to initialize assistant');
@@ -37,6 +39,7 @@ export const useSystemInfo = () => {
   return {
     assistantId,
     vectorStoreId,
+    threadId,
     initializationStatus,
     isInitializing,
     initializeAssistant
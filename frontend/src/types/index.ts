@@ -4,6 +4,31 @@ export interface FileInfo {
   path: string;
 }
 
+export type UploadJobStatus = 'queued' | 'running' | 'retrying' | 'succeeded' | 'failed';
+
+export interface UploadJob {
+  job_id: string;
+  filename: string;
+  size: number;
+  status: UploadJobStatus;
+  attempts: number;
+  max_attempts: number;
+  file_id: string | null;
+  error: {
+    type: string;
+    message: string;
+    transient: boolean;
+    attempt: number;
+  } | null;
+  created_at: number;
+  started_at: number | null;
+  finished_at: number | null;
+  timings: {
+    queue_wait_seconds: number | null;
+    processing_seconds: number | null;
+  };
+}
+
 export interface TokenUsage {
   prompt_tokens: number;
   completion_tokens: number;
@@ -21,6 +46,23 @@ export interface Message {
   isDxaResponse?: boolean;
 }
 
+export interface ThreadMessage {
+  id: string;
+  role: 'user' | 'assistant';
+  created_at: number;
+  run_id: string | null;
+  text: string;
+  image_file_ids: string[];
+  file_ids: string[];
+}
+
+export interface ThreadMessagePage {
+  thread_id: string;
+  messages: ThreadMessage[];
+  has_more: boolean;
+  next_cursor: string | null;
+}
+
 export interface RunStepToolCall {
   type: string;
   code_interpreter?: {